@@ -1,5 +1,25 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.models.signals import post_migrate
+
+
+def sync_settings(sender, using, **kwargs):
+    """
+    Synchronizes PYNOT_SETTINGS once the database is migrated. Nothing is
+    done while Pynot is migrated to an older migration, as its tables may
+    not match the models yet
+    """
+    loader = MigrationLoader(connections[using], ignore_no_migrations=True)
+    if set(loader.graph.leaf_nodes(sender.label)) - set(loader.applied_migrations):
+        return
+
+    from .models import PyNot
+    PyNot.sync_settings(using=using)
 
 
 class NotificationsConfig(AppConfig):
     name = 'pynot'
+
+    def ready(self):
+        post_migrate.connect(sync_settings, sender=self)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Partitions the Pynot archive tables by month on PostgreSQL
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from pynot.models import ArchivedEventNotificationFire, ArchivedNotification
+from pynot.utils import util_partitions
+
+
+class Command(BaseCommand):
+    help = "Partitions the Pynot archive tables by archiving month on " \
+           "PostgreSQL, creates the partitions of the next months and drops " \
+           "the old ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3,
+                            help="Months, from the current one, whose "
+                                 "partitions are created")
+        parser.add_argument('--keep', type=int, default=None,
+                            help="Months of archive kept; older partitions "
+                                 "are dropped")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning is only supported on PostgreSQL")
+
+        today = timezone.now().date()
+        for model in (ArchivedEventNotificationFire, ArchivedNotification):
+            table = model._meta.db_table
+            if not util_partitions.is_partitioned(table):
+                util_partitions.partition_table(table, 'archive_datetime')
+                self.stdout.write("{0} partitioned".format(table))
+
+            for name in util_partitions.create_partitions(
+                    table, 'archive_datetime', today, options['months']):
+                self.stdout.write("{0} ready".format(name))
+
+            if options['keep'] is not None:
+                limit = util_partitions.month_start(today, -options['keep'])
+                for name in util_partitions.drop_partitions_before(table,
+                                                                   limit):
+                    self.stdout.write("{0} dropped".format(name))
+
+        self.stdout.write(self.style.SUCCESS("Pynot archive partitioned"))
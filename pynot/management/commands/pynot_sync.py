@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Synchronizes the Pynot categories, events and parameters with PYNOT_SETTINGS
+"""
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from pynot.models import PyNot
+
+
+class Command(BaseCommand):
+    help = "Synchronizes the Pynot categories, events and parameters with " \
+           "PYNOT_SETTINGS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help="Database to synchronize")
+
+    def handle(self, *args, **options):
+        PyNot.sync_settings(force=True, using=options['database'])
+        self.stdout.write(self.style.SUCCESS("Pynot settings synchronized"))
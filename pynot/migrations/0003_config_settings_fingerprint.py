@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0002_notification_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='config',
+            name='settings_fingerprint',
+            field=models.CharField(default='', editable=False, max_length=40),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0003_config_settings_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventnotificationfire',
+            name='cursor',
+            field=models.CharField(default=None, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='eventnotificationfire',
+            name='recipients',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='eventnotificationfire',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pendiente'), ('in_process', 'Procesando'), ('complete', 'Completado'), ('error', 'Error')], default='complete', max_length=64),
+        ),
+    ]
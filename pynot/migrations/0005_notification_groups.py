@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0001_initial'),
+        ('pynot', '0004_eventnotificationfire_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='groups',
+            field=models.ManyToManyField(related_name='notifications', to='auth.Group'),
+        ),
+    ]
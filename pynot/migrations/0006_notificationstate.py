@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_collective(apps, schema_editor):
+    """
+    Notifications shared by several users were fired as collective ones
+    """
+    Notification = apps.get_model('pynot', 'Notification')
+    ids = list(Notification.objects.annotate(owners=models.Count('users'))
+               .filter(type=None, owners__gt=1).values_list('id', flat=True))
+    Notification.objects.filter(id__in=ids).update(collective=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pynot', '0005_notification_groups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='collective',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_collective, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='NotificationState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_read', models.BooleanField(default=False)),
+                ('read_datetime', models.DateTimeField(default=None, null=True)),
+                ('is_important', models.BooleanField(default=False)),
+                ('important_datetime', models.DateTimeField(default=None, null=True)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='pynot.notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'notification')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0007_notificationcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['creation_datetime', 'id'], name='pynot_notification_inbox'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+## Full indexes created instead of the partial ones on backends without
+## partial indexes
+FULL_INDEXES = [
+    models.Index(fields=['event', 'creation_datetime', 'id'],
+                 name='pynot_notif_event_inbox_all'),
+    models.Index(fields=['category', 'creation_datetime', 'id'],
+                 name='pynot_notif_category_inbox_all'),
+]
+
+
+def users_index(Notification):
+    """
+    Index of the notifications of each user, in the users through table
+    """
+    users = Notification._meta.get_field('users')
+    through = users.remote_field.through
+    return through, models.Index(
+        fields=[users.m2m_reverse_field_name(), 'notification'],
+        name='pynot_notif_users_inbox')
+
+
+def denormalize_event(apps, schema_editor):
+    """
+    Copies the event and the category of the fire to its notifications
+    """
+    Notification = apps.get_model('pynot', 'Notification')
+    EventNotificationFire = apps.get_model('pynot', 'EventNotificationFire')
+    Event = apps.get_model('pynot', 'Event')
+    Notification.objects.update(event_id=models.Subquery(
+        EventNotificationFire.objects
+        .filter(pk=models.OuterRef('notification_id'))
+        .values('event_notification__event_id')[:1]))
+    Notification.objects.update(category_id=models.Subquery(
+        Event.objects.filter(pk=models.OuterRef('event_id'))
+        .values('category_id')[:1]))
+
+
+def add_indexes(apps, schema_editor):
+    """
+    Adds the index of the users through table and, on backends without
+    partial indexes, the full indexes
+    """
+    Notification = apps.get_model('pynot', 'Notification')
+    schema_editor.add_index(*users_index(Notification))
+    if not schema_editor.connection.features.supports_partial_indexes:
+        for index in FULL_INDEXES:
+            schema_editor.add_index(Notification, index)
+
+
+def remove_indexes(apps, schema_editor):
+    """
+    Removes the indexes added by add_indexes
+    """
+    Notification = apps.get_model('pynot', 'Notification')
+    schema_editor.remove_index(*users_index(Notification))
+    if not schema_editor.connection.features.supports_partial_indexes:
+        for index in FULL_INDEXES:
+            schema_editor.remove_index(Notification, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0008_notification_inbox_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='category',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pynot.category'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='event',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pynot.event'),
+        ),
+        migrations.RunPython(denormalize_event, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_erased', False)), fields=['event', 'creation_datetime', 'id'], name='pynot_notif_event_inbox'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_erased', False)), fields=['category', 'creation_datetime', 'id'], name='pynot_notif_category_inbox'),
+        ),
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
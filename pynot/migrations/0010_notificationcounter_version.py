@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0009_notification_inbox_denormalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationcounter',
+            name='last_update_datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='notificationcounter',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
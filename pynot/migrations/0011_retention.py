@@ -0,0 +1,65 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0010_notificationcounter_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEventNotificationFire',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('event_notification_id', models.BigIntegerField()),
+                ('event_id', models.BigIntegerField()),
+                ('subject', models.TextField(default='')),
+                ('message', models.TextField()),
+                ('files', models.TextField(default='[]')),
+                ('creation_datetime', models.DateTimeField()),
+                ('archive_datetime', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedNotification',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fire_id', models.BigIntegerField()),
+                ('event_id', models.BigIntegerField(default=None, null=True)),
+                ('category_id', models.BigIntegerField(default=None, null=True)),
+                ('recipient', models.CharField(default=None, max_length=256, null=True)),
+                ('type', models.CharField(default=None, max_length=64, null=True)),
+                ('owner_id', models.BigIntegerField(default=None, null=True)),
+                ('users', models.TextField(default='[]')),
+                ('groups', models.TextField(default='[]')),
+                ('status', models.CharField(max_length=64)),
+                ('is_read', models.BooleanField(default=False)),
+                ('is_important', models.BooleanField(default=False)),
+                ('collective', models.BooleanField(default=False)),
+                ('creation_datetime', models.DateTimeField()),
+                ('archive_datetime', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_datetime', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha de creación del objeto')),
+                ('last_update_datetime', models.DateTimeField(verbose_name='Fecha de última actualización del objeto')),
+                ('is_erased', models.BooleanField(default=False, help_text='Si lo marca se borrará el elemento.', verbose_name='¿Borrado?')),
+                ('days', models.PositiveIntegerField()),
+                ('archive', models.BooleanField(default=False)),
+                ('category', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retention_policies', to='pynot.category')),
+                ('event', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retention_policies', to='pynot.event')),
+            ],
+            options={
+                'ordering': ['creation_datetime'],
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0011_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationBody',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('content', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='eventnotificationfire',
+            name='message_body',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pynot.notificationbody'),
+        ),
+        migrations.AddField(
+            model_name='eventnotificationfire',
+            name='subject_body',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pynot.notificationbody'),
+        ),
+    ]
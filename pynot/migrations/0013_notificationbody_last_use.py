@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0012_notificationbody'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationbody',
+            name='last_use_datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0013_notificationbody_last_use'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventnotificationfire',
+            name='pending_chunks',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:23
+
+from django.db import migrations, models
+
+
+## Full indexes created instead of the partial ones on backends without
+## partial indexes, replacing those of 0009
+OLD_FULL_INDEXES = [
+    models.Index(fields=['event', 'creation_datetime', 'id'],
+                 name='pynot_notif_event_inbox_all'),
+    models.Index(fields=['category', 'creation_datetime', 'id'],
+                 name='pynot_notif_category_inbox_all'),
+]
+FULL_INDEXES = [
+    models.Index(fields=['owner', 'creation_datetime', 'id'],
+                 name='pynot_notif_owner_inbox_all'),
+    models.Index(fields=['owner', 'event', 'creation_datetime', 'id'],
+                 name='pynot_notif_owner_event_all'),
+    models.Index(fields=['owner', 'category', 'creation_datetime', 'id'],
+                 name='pynot_notif_owner_categ_all'),
+]
+
+
+def replace_indexes(removed, added):
+    """
+    Replaces the full indexes on backends without partial indexes
+    """
+    def replace(apps, schema_editor):
+        if schema_editor.connection.features.supports_partial_indexes:
+            return
+        Notification = apps.get_model('pynot', 'Notification')
+        for index in removed:
+            schema_editor.remove_index(Notification, index)
+        for index in added:
+            schema_editor.add_index(Notification, index)
+    return replace
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pynot', '0014_eventnotificationfire_pending_chunks'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='pynot_notification_inbox',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='pynot_notif_event_inbox',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='pynot_notif_category_inbox',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_erased', False)), fields=['owner', 'creation_datetime', 'id'], name='pynot_notif_owner_inbox'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_erased', False)), fields=['owner', 'event', 'creation_datetime', 'id'], name='pynot_notif_owner_event_inbox'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_erased', False)), fields=['owner', 'category', 'creation_datetime', 'id'], name='pynot_notif_owner_categ_inbox'),
+        ),
+        migrations.RunPython(replace_indexes(OLD_FULL_INDEXES, FULL_INDEXES),
+                             replace_indexes(FULL_INDEXES, OLD_FULL_INDEXES)),
+    ]
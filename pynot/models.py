@@ -3,14 +3,32 @@
 Notifications models
 """
 from __future__ import unicode_literals
+import collections
+import contextlib
+import datetime
+import functools
+import hashlib
+import heapq
+import itertools
 import json
-from django.db import models
+import time
+import uuid
+import zlib
+from django.core.cache import caches
+from django.db import connection, models, router, transaction
+from django.db.models import signals
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.conf import settings
 
+from . import push
 from . import tasks
+from .utils.util_placeholder import compile_text, with_prefixes
+from .utils.util_settings import get_setting
 
 class SingletonModel(models.Model):
 	"""
@@ -19,6 +37,10 @@ class SingletonModel(models.Model):
 	class Meta:
 		abstract = True
 
+	## Segundos que se mantiene en memoria la instancia cargada, para que los
+	## cambios guardados por otros procesos lleguen a éste
+	load_ttl = 60
+
 	def save(self, *args, **kwargs):
 		"""
 		Sólo tendrá una tupla
@@ -28,6 +50,8 @@ class SingletonModel(models.Model):
 		"""
 		self.pk = 1
 		super(SingletonModel, self).save(*args, **kwargs)
+		# La próxima carga leerá de nuevo la instancia guardada
+		self.__class__._loaded = None
 
 	def delete(self, *args, **kwargs):
 		"""
@@ -41,10 +65,15 @@ class SingletonModel(models.Model):
 	@classmethod
 	def load(cls):
 		"""
-		Carga la instancia, como método de clase
+		Carga la instancia, como método de clase. La instancia se guarda en
+		memoria hasta que se vuelva a guardar o pasen load_ttl segundos
 		:return:
 		"""
-		obj, created = cls.objects.get_or_create(pk=1)
+		obj = cls.__dict__.get('_loaded')
+		if obj is None or time.monotonic() - cls._loaded_at > cls.load_ttl:
+			obj, created = cls.objects.get_or_create(pk=1)
+			cls._loaded = obj
+			cls._loaded_at = time.monotonic()
 		return obj
 
 NOTIFICATION_STATUS_TYPE = (
@@ -54,6 +83,8 @@ NOTIFICATION_STATUS_TYPE = (
     ("error", _("Error")),
 )
 
+SCHEMA_TYPES = ('body', 'email', 'user', 'group', 'file')
+
 RECIPIENT_TYPE = (
     ("email", _("Correo electrónico")),
     ("user", _("Usuario")),
@@ -255,6 +286,68 @@ class CommonModel(models.Model):
         return fields
 
 
+def chunks(iterable, size):
+    """
+    Splits an iterable in lists of, at most, size elements
+    :param iterable:
+    :param size:
+    :return:
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_save(model, new, changed, fields, now, key=None, using=None):
+    """
+    Inserts the new instances and updates the changed fields of the changed
+    ones, using bulk queries
+    :param model:
+    :param new: instances to insert
+    :param changed: instances to update
+    :param fields: fields to update
+    :param now: update datetime
+    :param key: unique field used to get the primary keys of the new
+    instances, on backends that do not return them
+    :param using: database alias
+    :return: whether something has been saved
+    """
+    for instance in new + changed:
+        instance.last_update_datetime = now
+
+    objects = model.all_objects.db_manager(using)
+    if new:
+        objects.bulk_create(new)
+        if key and new[0].pk is None:
+            ids = dict(objects.filter(
+                **{key + "__in": [getattr(instance, key) for instance in new]})
+                .values_list(key, 'id'))
+            for instance in new:
+                instance.pk = ids[getattr(instance, key)]
+
+    if changed:
+        objects.bulk_update(changed, fields + ('last_update_datetime', ))
+
+    return bool(new or changed)
+
+
+def atomic_if(enabled):
+    """
+    Transaction block when enabled, otherwise a no-op context manager
+    :param enabled:
+    :return:
+    """
+    if enabled:
+        return transaction.atomic()
+    return contextlib.ExitStack()
+
+
+@functools.lru_cache(maxsize=None)
 def get_class(class_name):
     parts = class_name.split('.')
     module = ".".join(parts[:-1])
@@ -264,55 +357,284 @@ def get_class(class_name):
     return m
 
 
+def to_builtin(data):
+    """
+    Converts the serialized data (ReturnDict, OrderedDict, ReturnList...) into
+    plain dicts and lists
+    :param data:
+    :return:
+    """
+    if isinstance(data, dict):
+        return {field: to_builtin(value) for field, value in data.items()}
+    if isinstance(data, list):
+        return [to_builtin(value) for value in data]
+    return data
+
+
+def is_relation(model, name):
+    """
+    Informs if name is a relation field of the model
+    :param model:
+    :param name:
+    :return:
+    """
+    try:
+        return model._meta.get_field(name).is_relation
+    except Exception:
+        return False
+
+
+def prune_serializer(serializer, paths, prefix=""):
+    """
+    Removes the fields of the serializer, and of its nested serializers, whose
+    paths are not in paths
+    :param serializer: serializer (or list serializer) whose data has not been
+    computed yet
+    :param paths: paths to keep, with their prefixes
+    :param prefix: prefix of the paths of the serializer fields
+    :return: lookups to prefetch the relations used by the nested serializers
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+
+    lookups = []
+    for name in list(serializer.fields):
+        if prefix + name not in paths:
+            serializer.fields.pop(name)
+            continue
+
+        field = serializer.fields[name]
+        if hasattr(getattr(field, 'child', field), 'fields'):
+            nested_lookups = prune_serializer(field, paths, prefix + name + ".")
+            if model and is_relation(model, field.source):
+                lookups.append(field.source)
+                lookups.extend(field.source + "__" + lookup
+                               for lookup in nested_lookups)
+
+    return lookups
+
+
 class Config(SingletonModel):
     email_template = models.TextField(_("Email template"), default="{{ message }}")
 
+    ## Fingerprint of the last PYNOT_SETTINGS synchronized
+    settings_fingerprint = models.CharField(max_length=40, default='',
+                                            editable=False)
+
 
 class PyNot(object):
+    ## Registry of hydrated events (with their parameters, notifications,
+    ## recipients and files) by slug
+    _events = {}
+
+    ## Version stamp of the registry, shared by every process through the
+    ## PYNOT_REGISTRY_CACHE cache
+    _version = None
+
+    ## Fingerprint of the PYNOT_SETTINGS synchronized by this process, by
+    ## database alias
+    _fingerprints = {}
+
+    @classmethod
+    def settings_fingerprint(cls):
+        """
+        Gets a hash of PYNOT_SETTINGS
+        :return:
+        """
+        return hashlib.sha1(json.dumps(settings.PYNOT_SETTINGS, sort_keys=True,
+                                       default=str).encode('utf-8')).hexdigest()
+
     @classmethod
-    def sync_settings(cls):
-        if hasattr(settings, "PYNOT_SETTINGS"):
-            for category_slug in settings.PYNOT_SETTINGS:
-                category, created = Category.objects.get_or_create(slug=category_slug)
-                new_name = settings.PYNOT_SETTINGS[category_slug]["name"]
-                if category.name != new_name:
-                    category.name = new_name
-                    category.save()
-
-                event_config = settings.PYNOT_SETTINGS[category_slug]["events"]
-                for event_slug in event_config:
-                    event, created = Event.objects.get_or_create(
-                        category=category,
-                        slug=event_slug
-                    )
-                    new_name = event_config[event_slug]["name"]
-                    new_description = event_config[event_slug]["description"]
-                    if event.name!=new_name or event.description!=new_description:
-                        event.name = new_name
-                        event.description = new_description
-                        event.save()
-
-                    parameters_config = event_config[event_slug]["parameters"]
-                    for parameter_slug in parameters_config:
-                        parameter, created = Parameter.objects.get_or_create(
-                            name=parameter_slug,
-                            event=event
-                        )
-                        new_name = parameters_config[parameter_slug]["human_name"]
-                        new_serializer = parameters_config[parameter_slug]["serializer"]
-                        if parameter.name != new_name or parameter.description != new_description:
-                            parameter.human_name = new_name
-                            parameter.serializer = new_serializer
-                            parameter.save()
+    def sync_settings(cls, force=False, using=None):
+        """
+        Synchronizes the categories, events and parameters with PYNOT_SETTINGS.
+        Nothing is done when the settings have not changed since the last
+        synchronization, unless force is given
+        :param force:
+        :param using: database alias, the default one of Config if not given
+        :return:
+        """
+        if not hasattr(settings, "PYNOT_SETTINGS"):
+            return
+
+        using = using or router.db_for_write(Config)
+        fingerprint = cls.settings_fingerprint()
+        if not force and fingerprint == cls._fingerprints.get(using):
+            return
+
+        # The fingerprint is read and written alone, so a stale Config of this
+        # process never overwrites the rest of the fields
+        configs = Config.objects.using(using).filter(pk=1)
+        stored = configs.values_list('settings_fingerprint', flat=True).first()
+        if force or stored != fingerprint:
+            with transaction.atomic(using=using):
+                if cls.apply_settings(settings.PYNOT_SETTINGS, using):
+                    cls.invalidate()
+                if not configs.update(settings_fingerprint=fingerprint):
+                    Config(pk=1, settings_fingerprint=fingerprint).save(
+                        using=using)
+
+        cls._fingerprints[using] = fingerprint
+
+    @classmethod
+    def apply_settings(cls, pynot_settings, using=None):
+        """
+        Creates or updates the categories, events and parameters that differ
+        from the settings. Existing rows are read with a query per model, and
+        the differences are written in bulk
+        :param pynot_settings:
+        :param using: database alias
+        :return: whether something has changed
+        """
+        events_config = {}
+        for category_slug in pynot_settings:
+            for event_slug, event_config in \
+                    pynot_settings[category_slug]["events"].items():
+                events_config[event_slug] = (category_slug, event_config)
+
+        categories = {category.slug: category for category in
+                      Category.all_objects.using(using)
+                      .filter(slug__in=list(pynot_settings))}
+        events = {event.slug: event for event in
+                  Event.all_objects.using(using)
+                  .filter(slug__in=list(events_config))}
+        parameters = {(parameter.event_id, parameter.name): parameter
+                      for parameter in Parameter.all_objects.using(using)
+                      .filter(event__slug__in=list(events_config))}
+
+        now = timezone.now()
+        changes = False
+
+        new, changed = [], []
+        for category_slug in pynot_settings:
+            name = str(pynot_settings[category_slug]["name"])
+            category = categories.get(category_slug)
+            if category is None:
+                category = Category(slug=category_slug, name=name)
+                categories[category_slug] = category
+                new.append(category)
+            elif category.name != name:
+                category.name = name
+                changed.append(category)
+        changes |= bulk_save(Category, new, changed, ('name', ), now, 'slug',
+                             using)
+
+        new, changed, moved = [], [], []
+        for event_slug, (category_slug, event_config) in events_config.items():
+            values = {"category_id": categories[category_slug].pk,
+                      "name": str(event_config["name"]),
+                      "description": str(event_config["description"])}
+            event = events.get(event_slug)
+            if event is None:
+                event = Event(slug=event_slug, **values)
+                events[event_slug] = event
+                new.append(event)
+            elif any(getattr(event, field) != value
+                     for field, value in values.items()):
+                if event.category_id != values["category_id"]:
+                    moved.append(event.pk)
+                for field, value in values.items():
+                    setattr(event, field, value)
+                changed.append(event)
+        changes |= bulk_save(Event, new, changed,
+                             ('category', 'name', 'description'), now, 'slug',
+                             using)
+        if moved:
+            # bulk_update sends no post_save
+            Notification.denormalize_category(moved, using)
+
+        new, changed = [], []
+        for event_slug, (category_slug, event_config) in events_config.items():
+            event = events[event_slug]
+            parameters_config = event_config["parameters"]
+            for parameter_slug in parameters_config:
+                values = {"human_name": str(parameters_config[parameter_slug]
+                                            ["human_name"]),
+                          "serializer": parameters_config[parameter_slug]
+                                        ["serializer"]}
+                parameter = parameters.get((event.pk, parameter_slug))
+                if parameter is None:
+                    new.append(Parameter(event=event, name=parameter_slug,
+                                         **values))
+                elif any(getattr(parameter, field) != value
+                         for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(parameter, field, value)
+                    changed.append(parameter)
+        changes |= bulk_save(Parameter, new, changed,
+                             ('human_name', 'serializer'), now, using=using)
+
+        return changes
 
     @classmethod
     def event(cls, slug):
-        if not Event.objects.filter(slug=slug).exists():
-            cls.sync_settings()
-        if not Event.objects.filter(slug=slug).exists():
-            raise Exception(_("No existe ningún evento con el slug indicado: ")+slug)
+        """
+        Gets the event of the slug from the registry, loading it when it is
+        not there yet
+        :param slug:
+        :return:
+        """
+        cls.check_version()
 
-        return Event.objects.get(slug=slug)
+        event = cls._events.get(slug)
+        if event is None:
+            event = cls.load_event(slug)
+            if event is None:
+                cls.sync_settings()
+                event = cls.load_event(slug)
+            if event is None:
+                raise Exception(_("No existe ningún evento con el slug indicado: ")+slug)
+            cls._events[slug] = event
+
+        return event
+
+    @classmethod
+    def load_event(cls, slug):
+        """
+        Loads the event of the slug with all the configuration used to fire it
+        :param slug:
+        :return:
+        """
+        return Event.objects.filter(slug=slug).prefetch_related(
+            'parameters', 'notifications__recipients', 'notifications__files')\
+            .first()
+
+    @classmethod
+    def check_version(cls):
+        """
+        Empties the registry when another process has invalidated it
+        :return:
+        """
+        cache_alias = get_setting("PYNOT_REGISTRY_CACHE")
+        if cache_alias:
+            version = caches[cache_alias].get_or_set("pynot:registry:version",
+                                                     uuid.uuid4().hex, None)
+            if version != cls._version:
+                cls._events = {}
+                cls._version = version
+
+    @classmethod
+    def discard(cls, slug):
+        """
+        Removes the event of the slug from the registry of this process, so it
+        is loaded again the next time
+        :param slug:
+        :return:
+        """
+        cls._events.pop(slug, None)
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Empties the registry of this process, and of every other process when
+        the PYNOT_REGISTRY_CACHE cache is configured
+        :return:
+        """
+        cls._events = {}
+        cache_alias = get_setting("PYNOT_REGISTRY_CACHE")
+        if cache_alias:
+            caches[cache_alias].set("pynot:registry:version",
+                                    uuid.uuid4().hex, None)
 
 class Category(CommonModel):
     """
@@ -345,58 +667,132 @@ class Event(CommonModel):
                                  related_name="events")
 
     @staticmethod
-    def expand_params(params, prefix=""):
-        expanded={}
+    def expand_params(params, prefix="", paths=None):
+        """
+        Flattens the serialized params in a dict of dotted paths. The values of
+        the fields inside lists are joined in tuples
+        :param params: serialized params
+        :param prefix: prefix of the paths
+        :param paths: if given, only these paths (and their prefixes) are
+        expanded. See Event.referenced_paths
+        :return:
+        """
+        expanded = {}
+        Event._expand_into(expanded, params, prefix, paths, False)
+        for field in expanded:
+            if isinstance(expanded[field], list):
+                expanded[field] = tuple(expanded[field])
+        return expanded
+
+    @staticmethod
+    def _expand_into(expanded, params, prefix, paths, in_list):
+        """
+        Adds the expanded params to the expanded dict, in place
+        :param expanded: result dict
+        :param params: serialized params
+        :param prefix: prefix of the paths
+        :param paths: paths to expand, or None to expand every path
+        :param in_list: whether params is an item of a list, so its values
+        have to be joined with the other items
+        :return:
+        """
         for field in params:
+            path = prefix + field
+            if paths is not None and path not in paths:
+                continue
+
             if isinstance(params[field], dict):
                 ## if this field is a dict, we need to expand it
-                expanded = dict(expanded, **Event.expand_params(params[field],
-                                                          prefix + field + "."))
+                Event._expand_into(expanded, params[field], path + ".", paths,
+                                   in_list)
             elif isinstance(params[field], list):
                 ## if this field is a list, we need to join each item
-                expanded_list = None
                 for data in params[field]:
                     if isinstance(data, dict):
-                        expanded_item = Event.expand_params(data,
-                                                        prefix + field + ".")
-                        ## as we going to join the items, we need each item has to
-                        ## be a tuple
-                        for param in expanded_item:
-                            if not isinstance(expanded_item[param], tuple):
-                                expanded_item[param] = (expanded_item[param],)
-
-                        if expanded_list is None:
-                            expanded_list = expanded_item
-                        else:
-                            for param in expanded_list:
-                                expanded_list[param] = expanded_list[param] + \
-                                                       expanded_item[param]
-                if expanded_list:
-                    expanded = dict(expanded, **expanded_list)
+                        Event._expand_into(expanded, data, path + ".", paths,
+                                           True)
+            elif in_list:
+                expanded.setdefault(path, []).append(params[field].__str__())
             else:
-                expanded[prefix + field]=params[field].__str__()
+                expanded[path] = params[field].__str__()
 
-        return expanded
+    def referenced_paths(self, notifications=None):
+        """
+        Gets the paths of the params used by the notifications of the event, in
+        their subjects, messages, recipients and files, with their prefixes
+        :param notifications: notifications of the event, if already loaded
+        :return:
+        """
+        if notifications is None:
+            notifications = self.notifications.all()
 
-    def fire(self, **kwargs):
+        keys = set()
+        for notification in notifications:
+            keys.update(notification.referenced_keys())
+        return with_prefixes(keys)
+
+    def serialize_params(self, params, paths=None):
+        """
+        Serializes the parameters of the event, giving a JSON compatible dict
+        :param params: event parameters, model instances or serializers
+        :param paths: if given, the serializers only compute these paths, and
+        the relations they need are prefetched. See Event.referenced_paths
+        :return:
+        """
         data = {}
         for param in self.parameters.all():
-            if param.name not in kwargs:
+            if param.name not in params:
                 raise Exception("The event {} needs a serializer param named {}"
                                 .format(self.name, param.name))
 
-            if isinstance(kwargs[param.name], models.Model):
-                kwargs[param.name] = get_class(param.serializer)(kwargs[param.name])
+            value = params[param.name]
+            if isinstance(value, models.Model):
+                serializer = get_class(param.serializer)(value)
+                if paths is not None:
+                    lookups = prune_serializer(serializer, paths,
+                                               param.name + ".")
+                    models.prefetch_related_objects([value], *lookups)
+                value = serializer
+            elif paths is not None and not hasattr(value, '_data'):
+                prune_serializer(value, paths, param.name + ".")
 
-            data[param.name]=json.loads(json.dumps(kwargs[param.name].data))
+            data[param.name] = to_builtin(value.data)
 
-        expanded = Event.expand_params(data)
+        return data
+
+    def hydrated_notifications(self):
+        """
+        Gets the notifications of the event with their recipients and files.
+        Relations already loaded by the registry are not queried again
+        :return:
+        """
+        notifications = list(self.notifications.all())
+        models.prefetch_related_objects(notifications, 'recipients', 'files')
+        return notifications
+
+    def fire(self, **kwargs):
+        notifications = self.hydrated_notifications()
+        paths = self.referenced_paths(notifications)
+        expanded = Event.expand_params(self.serialize_params(kwargs, paths),
+                                       paths=paths)
 
         ## Fire each event notification passing the expanded parameters
-        for notification in self.notifications.all():
+        for notification in notifications:
             notification.fire(expanded)
         return True
 
+    def fire_async(self, **kwargs):
+        """
+        Serializes the parameters and queues the fan-out of the event, so each
+        notification and each chunk of recipients is processed by the workers
+        :param kwargs: event parameters
+        :return:
+        """
+        data = self.serialize_params(
+            kwargs, self.referenced_paths(self.hydrated_notifications()))
+        transaction.on_commit(lambda: tasks.fire_event.delay(self.slug, data))
+        return True
+
 
 class Parameter(CommonModel):
     """
@@ -418,74 +814,91 @@ class Parameter(CommonModel):
 
     @staticmethod
     def get_schema(serializer, obj_type):
+        return Parameter.get_schemas(serializer)[obj_type]
+
+    @staticmethod
+    def get_schemas(serializer):
+        """
+        Walks the serializer once, getting the schema of each type of data
+        :param serializer:
+        :return: dict with a schema for each one of SCHEMA_TYPES
+        """
         fields = serializer.get_fields()
+        meta = serializer.Meta
 
-        data = {}
+        data = {obj_type: {} for obj_type in SCHEMA_TYPES}
         for field in fields:
-            data_field = {"human_name": field}
-
-            if hasattr(serializer.Meta, 'extra_fields_human_name') and \
-                    field in serializer.Meta.extra_fields_human_name:
-                data_field = {"human_name":
-                                serializer.Meta.extra_fields_human_name[field]}
-
-            exclude_field = False
-
-            if type(fields[field]).__name__ == "ListSerializer":
-                if obj_type=='body':
-                    exclude_field = True
-                else:
-                    data_field["data"] = \
-                        Parameter.get_schema(fields[field].child, obj_type)
-                    if len(data_field["data"]) == 0:
-                        exclude_field = True
-            elif hasattr(fields[field], "get_fields"):
-                data_field["data"] = \
-                    Parameter.get_schema(fields[field], obj_type)
-                if len(data_field["data"]) == 0:
-                    exclude_field = True
-            elif obj_type == 'email':
-                if type(fields[field]).__name__ != 'EmailField' and \
-                        (not hasattr(serializer.Meta, 'extra_fields_email')
-                        or not field in serializer.Meta.extra_fields_email):
-                    exclude_field = True
-            elif obj_type == 'user':
-                if not hasattr(serializer.Meta, 'extra_fields_user') \
-                        or not field in serializer.Meta.extra_fields_user:
-                    exclude_field = True
-            elif obj_type == 'group':
-                if not hasattr(serializer.Meta, 'extra_fields_group') \
-                        or not field in serializer.Meta.extra_fields_group:
-                    exclude_field = True
-            elif obj_type == 'file':
-                if not hasattr(serializer.Meta, 'extra_fields_file') \
-                        or not field in serializer.Meta.extra_fields_file:
-                    exclude_field = True
-
-            if not exclude_field:
-                data[field] = data_field
+            human_name = field
+            if hasattr(meta, 'extra_fields_human_name') and \
+                    field in meta.extra_fields_human_name:
+                human_name = meta.extra_fields_human_name[field]
+
+            field_type = type(fields[field]).__name__
+            if field_type == "ListSerializer" or \
+                    hasattr(fields[field], "get_fields"):
+                nested = Parameter.get_schemas(
+                    getattr(fields[field], "child", fields[field]))
+                for obj_type in SCHEMA_TYPES:
+                    if len(nested[obj_type]) == 0 or \
+                            (obj_type == 'body' and field_type == "ListSerializer"):
+                        continue
+                    data[obj_type][field] = {"human_name": human_name,
+                                             "data": nested[obj_type]}
+                continue
+
+            included = {
+                'body': True,
+                'email': field_type == 'EmailField' or
+                         field in getattr(meta, 'extra_fields_email', ()),
+                'user': field in getattr(meta, 'extra_fields_user', ()),
+                'group': field in getattr(meta, 'extra_fields_group', ()),
+                'file': field in getattr(meta, 'extra_fields_file', ()),
+            }
+            for obj_type in SCHEMA_TYPES:
+                if included[obj_type]:
+                    data[obj_type][field] = {"human_name": human_name}
 
         return data
 
     @property
     def data_body(self):
-        return Parameter.get_schema(get_class(self.serializer)(), 'body')
+        return get_serializer_schemas(self.serializer)['body']
 
     @property
     def data_email(self):
-        return Parameter.get_schema(get_class(self.serializer)(), 'email')
+        return get_serializer_schemas(self.serializer)['email']
 
     @property
     def data_user(self):
-        return Parameter.get_schema(get_class(self.serializer)(), 'user')
+        return get_serializer_schemas(self.serializer)['user']
 
     @property
     def data_group(self):
-        return Parameter.get_schema(get_class(self.serializer)(), 'group')
+        return get_serializer_schemas(self.serializer)['group']
 
     @property
     def data_file(self):
-        return Parameter.get_schema(get_class(self.serializer)(), 'file')
+        return get_serializer_schemas(self.serializer)['file']
+
+
+@functools.lru_cache(maxsize=None)
+def get_serializer_schemas(class_name):
+    """
+    Gets the schemas of the serializer class, computed once per process. When
+    PYNOT_SCHEMA_CACHE names a cache, they are shared by every process too
+    :param class_name: dotted path of the serializer
+    :return:
+    """
+    cache_alias = get_setting("PYNOT_SCHEMA_CACHE")
+    if not cache_alias:
+        return Parameter.get_schemas(get_class(class_name)())
+
+    key = "pynot:schema:" + hashlib.sha1(class_name.encode('utf-8')).hexdigest()
+    schemas = caches[cache_alias].get(key)
+    if schemas is None:
+        schemas = Parameter.get_schemas(get_class(class_name)())
+        caches[cache_alias].set(key, schemas)
+    return schemas
 
 
 class EventNotification(CommonModel):
@@ -518,82 +931,139 @@ class EventNotification(CommonModel):
     ## Message
     message = models.TextField()
 
-    def fire(self, data):
-        subject = self.subject
-        message = self.message
-        recipient_emails = ()
-        recipient_users = ()
-        recipient_groups = ()
-        files = ()
-
-        for field in data:
-            if not isinstance(data[field], tuple):
-                subject = subject.replace(field, data[field])
-                message = message.replace(field, data[field])
-
-        for recipient in self.recipients.all():
-            found = False
-            for field in data:
-                if recipient.recipient == field:
-                    found = True
-                    if not isinstance(data[field], tuple):
-                        recipient_list = (data[field], )
-                    else:
-                        recipient_list = data[field]
-
-                    if recipient.type == "email":
-                        recipient_emails = recipient_emails + recipient_list
-                    elif recipient.type == "user":
-                        recipient_users = recipient_users + recipient_list
-                    elif recipient.type == "group":
-                        recipient_groups = recipient_groups + recipient_list
-
-            if not found and recipient.recipient.find("@"):
-                if recipient.type == "email":
-                    recipient_emails = recipient_emails + (recipient.recipient, )
-
-        for file in self.files.all():
-            for field in data:
-                if file.file == field:
-                    if not isinstance(data[field], tuple):
-                        files_list = (data[field], )
-                    else:
-                        files_list = data[field]
+    def save(self, *args, **kwargs):
+        """
+        Saves the notification, discarding its compiled subject and message
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        self.__dict__.pop('_compiled', None)
+        super(EventNotification, self).save(*args, **kwargs)
 
-                    files = files + files_list
+    def compiled(self, field):
+        """
+        Gets the PlaceholderTemplate of the subject or the message, compiled
+        once until the notification is saved again
+        :param field: "subject" or "message"
+        :return:
+        """
+        compiled = self.__dict__.setdefault('_compiled', {})
+        if field not in compiled:
+            compiled[field] = compile_text(getattr(self, field))
+        return compiled[field]
 
-        ## Here we have completed message, recipient_emails, recipient_users and
-        ## recipient_groups
-        fire = EventNotificationFire.objects.create(event_notification=self,
-                                    subject=subject,
-                                    message=message)
+    @staticmethod
+    def resolve_users(user_ids, group_ids, chunk_size, after=None):
+        """
+        Yields, in ascending order, the distinct ids of the users and of the
+        members of the groups. Members of every group are streamed with a
+        single query
+        :param user_ids: ids of the user recipients
+        :param group_ids: ids of the group recipients
+        :param chunk_size: rows fetched from the database each time
+        :param after: only the ids greater than this one are yielded
+        :return:
+        """
+        pk = get_user_model()._meta.pk
+        users = set(pk.to_python(user_id) for user_id in user_ids)
+        if after is not None:
+            after = pk.to_python(after)
+            users = [user_id for user_id in users if user_id > after]
+        streams = [iter(sorted(users))]
+
+        if group_ids:
+            members = get_user_model().objects\
+                .filter(groups__id__in=set(group_ids))\
+                .order_by('id').distinct()\
+                .values_list('id', flat=True)
+            if after is not None:
+                members = members.filter(id__gt=after)
+            streams.append(members.iterator(chunk_size=chunk_size))
 
-        for file in files:
-            EventNotificationFireFile.objects.create(path=file, fire=fire)
+        last = None
+        for user_id in heapq.merge(*streams):
+            if user_id != last:
+                yield user_id
+                last = user_id
 
-        for email in recipient_emails:
-            notification = Notification.objects.create(notification=fire,
-                                        recipient=email,
-                                        type='email')
+    def referenced_keys(self):
+        """
+        Gets the expanded param keys used by the notification
+        :return:
+        """
+        keys = self.compiled("subject").keys() | self.compiled("message").keys()
+        keys.update(recipient.recipient for recipient in self.recipients.all())
+        keys.update(file.file for file in self.files.all())
+        return keys
 
-            tasks.send_email.delay(notification.id)
+    def fire(self, data, defer=False):
+        """
+        Fires the notification, creating the fire and the notifications of
+        each recipient
+        :param data: expanded parameters
+        :param defer: queue a task for each chunk of recipients instead of
+        writing them in the current process
+        :return: EventNotificationFire
+        """
+        subject = self.compiled("subject").render(data)
+        message = self.compiled("message").render(data)
+        recipients = {"email": [], "user": [], "group": []}
+        files = []
 
-        for group in recipient_groups:
-            users = get_user_model().objects.filter(groups__id=group)\
-                .values_list('id', flat=True)
-            recipient_users = recipient_users + tuple(users)
+        for recipient in self.recipients.all():
+            value = data.get(recipient.recipient)
+            if value is not None:
+                if recipient.type in recipients:
+                    recipients[recipient.type].extend(
+                        value if isinstance(value, tuple) else (value, ))
+            elif recipient.recipient.find("@") and recipient.type == "email":
+                recipients["email"].append(recipient.recipient)
 
-        if self.collective:
-            # We add every recipient as aowner of the same notification
-            notification = Notification.objects.create(notification=fire,
-                                                       status='complete')
-            notification.users.add(recipient_users)
-        else:
-            # each recipient has a single notification
-            for user in recipient_users:
-                notification = Notification.objects.create(notification=fire,
-                                                           status='complete')
-                notification.users.add(user)
+        for file in self.files.all():
+            value = data.get(file.file)
+            if value is not None:
+                files.extend(value if isinstance(value, tuple) else (value, ))
+
+        ## Here we have completed message and recipients. The users of the
+        ## groups are resolved while the notifications are written
+        chunk_size = get_setting("PYNOT_BULK_CHUNK_SIZE")
+
+        with atomic_if(get_setting("PYNOT_FIRE_ATOMIC") == "fire"):
+            texts = {"subject": subject, "message": message}
+            if get_setting("PYNOT_BODY_STORE"):
+                bodies = NotificationBody.store([subject, message])
+                texts = {"subject_body": bodies[subject],
+                         "message_body": bodies[message]}
+
+            fire = EventNotificationFire.objects.create(
+                event_notification=self,
+                status='pending',
+                **texts,
+                recipients=json.dumps({
+                    # Duplicated emails would receive the same message several
+                    # times
+                    "emails": list(dict.fromkeys(recipients["email"])),
+                    "users": [str(user) for user in recipients["user"]],
+                    "groups": [str(group) for group in recipients["group"]]}))
+
+            now = timezone.now()
+            EventNotificationFireFile.objects.bulk_create(
+                [EventNotificationFireFile(path=file, fire=fire,
+                                           last_update_datetime=now)
+                 for file in files],
+                batch_size=chunk_size)
+
+            if self.collective:
+                # We add every recipient as owner of the same notification
+                Notification.objects.create(notification=fire,
+                                            status='complete',
+                                            collective=True,
+                                            **fire.notification_fields)
+
+            fire.deliver(defer)
+
+        return fire
 
 
 class EventNotificationRecipient(CommonModel):
@@ -621,6 +1091,115 @@ class EventNotificationFile(CommonModel):
                               related_name="files")
 
 
+class NotificationBody(models.Model):
+    """
+    Subject or message of the fires, stored once by its SHA-256, so the fires
+    with the same content share it
+    """
+
+    ## SHA-256 of the text
+    hash = models.CharField(max_length=64, unique=True)
+
+    ## Text encoded as UTF-8, compressed with zlib when compressed is set
+    content = models.BinaryField()
+
+    ## Compressed content
+    compressed = models.BooleanField(default=False)
+
+    ## Last time that a fire was stored with this body
+    last_use_datetime = models.DateTimeField(default=timezone.now)
+
+    ## Bodies used within this time are never orphans, as a fire being
+    ## written may be about to reference them
+    orphan_grace = datetime.timedelta(days=1)
+
+    @cached_property
+    def text(self):
+        """
+        Text of the body
+        :return:
+        """
+        content = bytes(self.content)
+        if self.compressed:
+            content = zlib.decompress(content)
+        return content.decode('utf-8')
+
+    @classmethod
+    def store(cls, texts):
+        """
+        Returns the bodies of the texts, creating those that do not exist
+        :param texts:
+        :return: dict of the bodies by text
+        """
+        hashes = {text: hashlib.sha256(text.encode('utf-8')).hexdigest()
+                  for text in texts}
+        bodies = {body.hash: body for body in
+                  cls.objects.filter(hash__in=hashes.values())
+                  .only('id', 'hash', 'last_use_datetime')}
+
+        # The bodies reused are kept out of the orphans purge while the fire
+        # that references them is written
+        now = timezone.now()
+        stale = [body.id for body in bodies.values()
+                 if body.last_use_datetime < now - cls.orphan_grace / 2]
+        if stale and cls.objects.filter(id__in=stale)\
+                .update(last_use_datetime=now) < len(stale):
+            # Some of them were purged meanwhile, so they are created again
+            bodies = {body.hash: body for body in
+                      cls.objects.filter(hash__in=hashes.values())
+                      .only('id', 'hash')}
+
+        missing = set(hashes.values()) - set(bodies)
+        if missing:
+            compress = get_setting("PYNOT_BODY_COMPRESS")
+            new = []
+            for text, hash in hashes.items():
+                if hash in missing:
+                    content = text.encode('utf-8')
+                    compressed = zlib.compress(content) if compress else content
+                    new.append(cls(hash=hash,
+                                   content=min(content, compressed, key=len),
+                                   compressed=len(compressed) < len(content)))
+            cls.objects.bulk_create(new, ignore_conflicts=True)
+            bodies.update((body.hash, body) for body in
+                          cls.objects.filter(hash__in=missing).only('id', 'hash'))
+
+        # The texts are known, so the bodies are never read back
+        for text, hash in hashes.items():
+            bodies[hash].__dict__['text'] = text
+        return {text: bodies[hash] for text, hash in hashes.items()}
+
+    @classmethod
+    def orphans(cls):
+        """
+        Bodies no longer referenced by any fire, for example after a purge.
+        Those used within orphan_grace are skipped
+        :return:
+        """
+        fires = EventNotificationFire.all_objects
+        return cls.objects\
+            .filter(last_use_datetime__lt=timezone.now() - cls.orphan_grace)\
+            .exclude(id__in=fires.filter(subject_body__isnull=False)
+                     .values('subject_body_id'))\
+            .exclude(id__in=fires.filter(message_body__isnull=False)
+                     .values('message_body_id'))
+
+    @classmethod
+    def purge_orphans(cls, chunk_size):
+        """
+        Deletes the orphan bodies in chunks. Each chunk is checked again while
+        it is deleted, so the bodies reused since it was read are kept
+        :param chunk_size:
+        :return: number of bodies deleted
+        """
+        deleted = 0
+        while True:
+            ids = list(cls.orphans().values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return deleted
+            deleted += cls.orphans().filter(id__in=ids).delete()[0]
+
+
 class EventNotificationFire(CommonModel):
     ## Related event notification
     event_notification = models.ForeignKey(EventNotification,
@@ -633,6 +1212,278 @@ class EventNotificationFire(CommonModel):
     ## Message
     message = models.TextField()
 
+    ## Stored subject, instead of subject, when PYNOT_BODY_STORE is enabled
+    subject_body = models.ForeignKey(NotificationBody,
+                                     on_delete=models.PROTECT,
+                                     related_name="+",
+                                     null=True,
+                                     default=None)
+
+    ## Stored message, instead of message, when PYNOT_BODY_STORE is enabled
+    message_body = models.ForeignKey(NotificationBody,
+                                     on_delete=models.PROTECT,
+                                     related_name="+",
+                                     null=True,
+                                     default=None)
+
+    ## Fan-out status
+    status = models.CharField(max_length=64,
+                              choices=NOTIFICATION_STATUS_TYPE,
+                              default='complete')
+
+    ## Pending recipients (JSON with emails, users and groups), until the
+    ## fan-out is complete
+    recipients = models.TextField(default='', editable=False)
+
+    ## Last user notified, in ascending id order, so an interrupted fan-out
+    ## can be resumed from it
+    cursor = models.CharField(max_length=64, null=True, default=None,
+                              editable=False)
+
+    ## Deferred chunks of recipients not yet written, plus one while they are
+    ## being queued. The fan-out is complete when it reaches zero
+    pending_chunks = models.IntegerField(default=0, editable=False)
+
+    @property
+    def subject_text(self):
+        """
+        Subject, from the body store or from the fire
+        :return:
+        """
+        return self.subject_body.text if self.subject_body_id else self.subject
+
+    @property
+    def message_text(self):
+        """
+        Message, from the body store or from the fire
+        :return:
+        """
+        return self.message_body.text if self.message_body_id else self.message
+
+    @cached_property
+    def notification_fields(self):
+        """
+        Event and category of the notifications of this fire, denormalized so
+        the inbox filters by them without joins
+        :return:
+        """
+        event = self.event_notification.event
+        return {'event_id': event.id, 'category_id': event.category_id}
+
+    def deliver(self, defer=False, resume=False):
+        """
+        Writes the notifications of the recipients, chunk by chunk, streaming
+        the members of the groups from the database. The progress is saved
+        after each chunk, so an interrupted fan-out can be resumed. Deferred
+        chunks save it when they are written, with chunk_done
+        :param defer: queue a task for each chunk instead of writing it
+        :param resume: the fan-out has been interrupted, so the recipients
+        already notified are skipped
+        :return:
+        """
+        chunk_size = get_setting("PYNOT_BULK_CHUNK_SIZE")
+        atomic = get_setting("PYNOT_FIRE_ATOMIC")
+        recipients = json.loads(self.recipients)
+
+        values = {'status': 'in_process', 'last_update_datetime': timezone.now()}
+        if defer:
+            values['pending_chunks'] = 1
+        self.update(**values)
+
+        notification_id = self.notifications.filter(owner=None, type=None)\
+            .values_list('id', flat=True).first()
+
+        if notification_id and recipients["groups"] and \
+                get_setting("PYNOT_COLLECTIVE_GROUPS"):
+            # The audience of the collective notification is stored by
+            # reference, and its members are resolved when it is read
+            groups = set(recipients["groups"])
+            if resume:
+                groups -= set(str(group) for group in
+                              Notification.groups.through.objects
+                              .filter(notification_id=notification_id)
+                              .values_list('group_id', flat=True))
+            Notification(id=notification_id).groups.add(*groups)
+            if groups and Notification.users_have_groups():
+                NotificationCounter.add(
+                    get_user_model().groups.through.objects
+                    .filter(group_id__in=groups).values('user_id'), 1)
+            self.publish(groups=groups)
+            recipients["groups"] = []
+
+        # Members of the groups could be notified by the database itself
+        db_groups = []
+        if not defer and get_setting("PYNOT_DB_FANOUT") and \
+                Notification.can_insert_group_members():
+            db_groups, recipients["groups"] = recipients["groups"], []
+
+        # Chunks publish their users once they commit. When the fan-out runs
+        # inside a single transaction that would keep every channel until it
+        # commits, and with db_groups the members notified directly would be
+        # published twice, so the fire then publishes its users at the end,
+        # reading them back in batches
+        publish_chunks = not (connection.in_atomic_block or db_groups)
+
+        users = EventNotification.resolve_users(recipients["users"],
+                                                recipients["groups"],
+                                                chunk_size, after=self.cursor)
+        recipient_chunks = itertools.chain(
+            ({"emails": chunk} for chunk in chunks(recipients["emails"],
+                                                   chunk_size)),
+            ({"users": chunk, "notification_id": notification_id}
+             for chunk in chunks(users, chunk_size)))
+
+        for recipient_chunk in recipient_chunks:
+            # Deferred chunks of the fire may still be written while it is
+            # resumed, so each chunk locks the fire
+            with atomic_if(atomic == "chunk" or resume):
+                if defer:
+                    # The chunks may be written in any order, so the cursor
+                    # is not saved
+                    self.update(pending_chunks=models.F('pending_chunks') + 1,
+                                last_update_datetime=timezone.now())
+                    transaction.on_commit(
+                        lambda kwargs=recipient_chunk: tasks.fire_recipients.delay(
+                            self.id, **kwargs))
+                    continue
+
+                if resume:
+                    self.lock()
+                self.notify(skip_notified=resume, publish=publish_chunks,
+                            **recipient_chunk)
+                if "users" in recipient_chunk:
+                    self.update(cursor=str(recipient_chunk["users"][-1]),
+                                last_update_datetime=timezone.now())
+
+        if db_groups:
+            with atomic_if(atomic == "chunk"):
+                Notification.insert_group_members(self, db_groups,
+                                                  notification_id)
+
+        if not defer and not publish_chunks:
+            transaction.on_commit(self.publish_notified)
+
+        if defer:
+            self.chunk_done()
+        else:
+            # The deferred chunks still queued find every recipient notified
+            self.update(status='complete', recipients='', pending_chunks=0,
+                        last_update_datetime=timezone.now())
+
+    def lock(self):
+        """
+        Locks the row of this fire until the end of the transaction, so the
+        chunks of recipients written at the same time, by the chunk tasks
+        or by a resumed fan-out, skip the recipients notified by each other
+        :return:
+        """
+        list(EventNotificationFire.all_objects.select_for_update()
+             .filter(pk=self.pk).values_list('pk', flat=True))
+
+    def chunk_done(self):
+        """
+        Acknowledges a deferred chunk of recipients. The fan-out is complete
+        once every chunk queued has been written. Chunks written after the
+        fan-out has been resumed and completed change nothing
+        :return:
+        """
+        fires = EventNotificationFire.all_objects.filter(pk=self.pk,
+                                                         status='in_process')
+        fires.update(pending_chunks=models.F('pending_chunks') - 1,
+                     last_update_datetime=timezone.now())
+        fires.filter(pending_chunks__lte=0)\
+            .update(status='complete', recipients='')
+
+    def notify(self, emails=(), users=(), notification_id=None,
+               skip_notified=False, publish=True):
+        """
+        Creates the notifications of a chunk of recipients of this fire
+        :param emails: chunk of emails
+        :param users: chunk of user ids
+        :param notification_id: collective notification shared by the users
+        :param skip_notified: skip the recipients that already have their
+        notification, when the chunk may have been written before
+        :param publish: publish the users to the push broker
+        :return:
+        """
+        if skip_notified:
+            written = Notification.all_objects.filter(notification=self)
+            sent = set(written.filter(type='email', recipient__in=emails)
+                       .values_list('recipient', flat=True))
+            emails = [email for email in emails if email not in sent]
+            if notification_id:
+                notified = Notification.users.through.objects\
+                    .filter(notification_id=notification_id, user_id__in=users)\
+                    .values_list('user_id', flat=True)
+            else:
+                notified = written.filter(owner_id__in=users)\
+                    .values_list('owner_id', flat=True)
+            notified = set(notified)
+            users = [user for user in users if user not in notified]
+
+        notification_ids = Notification.bulk_create_emails(self, emails)
+        for batch in chunks(notification_ids,
+                            get_setting("PYNOT_EMAIL_BATCH_SIZE")):
+            transaction.on_commit(
+                lambda batch=batch: tasks.send_email_batch.delay(batch))
+
+        if notification_id:
+            Notification(id=notification_id).add_users(users)
+        elif users:
+            Notification.bulk_create_users(self, users)
+        if publish:
+            self.publish(users=users)
+
+    @cached_property
+    def push_payload(self):
+        """
+        Compact payload of this fire published to the push broker
+        :return:
+        """
+        return {"fire": self.id,
+                "event": self.notification_fields["event_id"],
+                "subject": self.subject_text}
+
+    def publish(self, users=(), groups=()):
+        """
+        Publishes a compact payload of this fire to the push broker, for the
+        users and the members of the groups, once the transaction commits
+        :param users: user ids
+        :param groups: group ids
+        :return:
+        """
+        broker = push.get_broker()
+        if broker is None or not (users or groups):
+            return
+        channels = ["user:{0}".format(user) for user in users] + \
+                   ["group:{0}".format(group) for group in set(groups)]
+        payload = self.push_payload
+        transaction.on_commit(lambda: broker.publish(channels, payload))
+
+    def publish_notified(self):
+        """
+        Publishes the payload of this fire to every user with a notification
+        of it, reading them in chunks, so memory does not grow with the
+        audience. Each user is published once
+        :return:
+        """
+        broker = push.get_broker()
+        if broker is None:
+            return
+        chunk_size = get_setting("PYNOT_BULK_CHUNK_SIZE")
+        owners = Notification.all_objects\
+            .filter(notification=self, owner__isnull=False)\
+            .values_list('owner_id', flat=True)
+        shared = Notification.users.through.objects\
+            .filter(notification__notification=self,
+                    notification__owner__isnull=True)\
+            .values_list('user_id', flat=True)
+        users = itertools.chain(owners.iterator(chunk_size=chunk_size),
+                                shared.iterator(chunk_size=chunk_size))
+        for chunk in chunks(users, chunk_size):
+            broker.publish(["user:{0}".format(user) for user in chunk],
+                           self.push_payload)
+
 
 class EventNotificationFireFile(CommonModel):
 
@@ -646,6 +1497,25 @@ class EventNotificationFireFile(CommonModel):
 
 
 class Notification(CommonModel):
+    class Meta(CommonModel.Meta):
+        indexes = [
+            ## Inbox of each owner, in the order of the cursor pagination,
+            ## and with its filters. The shared notifications have no owner,
+            ## so they are read in the same order from their NULL owner.
+            ## Erased notifications are never listed, so they are left out
+            ## where the backend supports partial indexes
+            models.Index(fields=['owner', 'creation_datetime', 'id'],
+                         name='pynot_notif_owner_inbox',
+                         condition=models.Q(is_erased=False)),
+            models.Index(fields=['owner', 'event', 'creation_datetime', 'id'],
+                         name='pynot_notif_owner_event_inbox',
+                         condition=models.Q(is_erased=False)),
+            models.Index(fields=['owner', 'category', 'creation_datetime',
+                                 'id'],
+                         name='pynot_notif_owner_categ_inbox',
+                         condition=models.Q(is_erased=False)),
+        ]
+
     ## Related event notification
     notification = models.ForeignKey(EventNotificationFire,
                                      on_delete=models.CASCADE,
@@ -666,6 +1536,32 @@ class Notification(CommonModel):
     users = models.ManyToManyField(get_user_model(),
                              related_name="notifications")
 
+    ## Groups whose members own the notification, for collective
+    ## notifications whose audience is stored by reference
+    groups = models.ManyToManyField(Group, related_name="notifications")
+
+    ## Owner of an individual notification. It is empty for email and
+    ## collective notifications
+    owner = models.ForeignKey(get_user_model(),
+                              on_delete=models.CASCADE,
+                              related_name="+",
+                              null=True,
+                              default=None)
+
+    ## Event of the fire, denormalized for the inbox filters
+    event = models.ForeignKey(Event,
+                              on_delete=models.CASCADE,
+                              related_name="+",
+                              null=True,
+                              default=None)
+
+    ## Category of the event, denormalized for the inbox filters
+    category = models.ForeignKey(Category,
+                                 on_delete=models.CASCADE,
+                                 related_name="+",
+                                 null=True,
+                                 default=None)
+
     ## Status
     status = models.CharField(max_length=64,
                               choices=NOTIFICATION_STATUS_TYPE,
@@ -681,4 +1577,766 @@ class Notification(CommonModel):
     is_important = models.BooleanField(
         default=False,
         verbose_name=_("Is important"),
-        help_text=_("The notification is important."))
\ No newline at end of file
+        help_text=_("The notification is important."))
+
+    ## Collective notification, shared by every owner. The reading status
+    ## and the importance of each owner are kept in NotificationState
+    collective = models.BooleanField(default=False)
+
+    @staticmethod
+    def with_user_state(queryset, user):
+        """
+        Annotates the reading status and the importance of the notifications
+        for the user, as user_is_read and user_is_important
+        :param queryset:
+        :param user:
+        :return:
+        """
+        states = NotificationState.objects.filter(user_id=user.id,
+                                                  notification=models.OuterRef('pk'))
+        return queryset.annotate(
+            user_is_read=Coalesce(
+                models.Subquery(states.values('is_read')[:1]), 'is_read'),
+            user_is_important=Coalesce(
+                models.Subquery(states.values('is_important')[:1]),
+                'is_important'))
+
+    def set_state(self, user, **values):
+        """
+        Sets the reading status (is_read) or the importance (is_important) of
+        the notification for the user, without saving the whole notification.
+        Collective notifications keep them in a NotificationState of the user
+        :param user:
+        :param values:
+        :return:
+        """
+        if not self.collective:
+            Notification.objects.filter(pk=self.pk).update(**values)
+            return
+
+        now = timezone.now()
+        defaults = dict(values)
+        if values.get('is_read'):
+            defaults['read_datetime'] = now
+        if values.get('is_important'):
+            defaults['important_datetime'] = now
+        NotificationState.objects.update_or_create(notification=self,
+                                                   user_id=user.id,
+                                                   defaults=defaults)
+
+    @staticmethod
+    def denormalize_category(event_ids, using=None):
+        """
+        Copies the category of the events to their notifications, with a
+        single UPDATE
+        :param event_ids:
+        :param using: database alias
+        :return:
+        """
+        Notification.all_objects.using(using)\
+            .filter(event_id__in=event_ids).update(
+            category_id=models.Subquery(
+                Event.all_objects.filter(pk=models.OuterRef('event_id'))
+                .values('category_id')[:1]))
+
+    @staticmethod
+    def bulk_set_state(queryset, user, field, value):
+        """
+        Sets the reading status (is_read) or the importance (is_important) of
+        the user on every notification of the queryset, with set-based
+        UPDATEs and without loading the notifications. Only the ids of the
+        collective ones are read, to create the states of the user
+        :param queryset: notifications of the user, annotated with
+        with_user_state
+        :param user:
+        :param field: is_read or is_important
+        :param value:
+        :return: number of notifications changed
+        """
+        queryset = queryset.filter(**{'user_' + field: not value})
+        count = queryset.filter(collective=False).update(**{field: value})
+
+        collective = list(queryset.filter(collective=True)
+                          .values_list('id', flat=True))
+        if collective:
+            values = {field: value}
+            if value:
+                values[field.replace('is_', '') + '_datetime'] = timezone.now()
+            NotificationState.objects.filter(
+                user_id=user.id, notification_id__in=collective).update(**values)
+            NotificationState.objects.bulk_create(
+                [NotificationState(user_id=user.id, notification_id=pk, **values)
+                 for pk in collective],
+                ignore_conflicts=True)
+        return count + len(collective)
+
+    @staticmethod
+    def owned_by(queryset, user):
+        """
+        Filters the notifications of the user: the individual ones it owns,
+        and those where the user is one of the users, or a member of one of
+        the groups
+        :param queryset:
+        :param user:
+        :return:
+        """
+        # Individual notifications are found by their owner, with the owner
+        # index; the users table is only read for the shared ones
+        owned = models.Q(owner_id=user.id) | models.Q(
+            owner__isnull=True,
+            id__in=Notification.users.through.objects
+            .filter(user_id=user.id).values('notification_id'))
+        if Notification.users_have_groups():
+            user_groups = get_user_model().groups.through.objects\
+                .filter(user_id=user.id).values('group_id')
+            owned |= models.Q(id__in=Notification.groups.through.objects
+                              .filter(group_id__in=user_groups)
+                              .values('notification_id'))
+        return queryset.filter(owned)
+
+    @staticmethod
+    def inbox_branches(queryset, user):
+        """
+        Splits the notifications of the user, filtered with owned_by, in its
+        individual ones and the shared ones. Each branch is read in inbox
+        order from the owner indexes, the shared one from the NULL owner
+        :param queryset:
+        :param user:
+        :return: list of querysets
+        """
+        return [queryset.filter(owner_id=user.id),
+                queryset.filter(owner__isnull=True)]
+
+    def add_users(self, user_ids):
+        """
+        Adds the users as owners of this notification using a single INSERT
+        :param user_ids:
+        :return:
+        """
+        Notification.users.through.objects.bulk_create(
+            [Notification.users.through(notification_id=self.id,
+                                        user_id=user_id)
+             for user_id in user_ids],
+            ignore_conflicts=True)
+
+        # The members of its groups have already been counted
+        members = None
+        if Notification.users_have_groups():
+            members = get_user_model().groups.through.objects\
+                .filter(group_id__in=Notification.groups.through.objects
+                        .filter(notification_id=self.id).values('group_id'))\
+                .values('user_id')
+        NotificationCounter.add(user_ids, 1, exclude=members)
+
+    @classmethod
+    def bulk_create_emails(cls, fire, emails):
+        """
+        Creates one pending email notification for each email of the chunk
+        :param fire: EventNotificationFire
+        :param emails: chunk of emails
+        :return: ids of the created notifications
+        """
+        now = timezone.now()
+        notifications = cls.objects.bulk_create(
+            [cls(notification=fire, recipient=email, type='email',
+                 last_update_datetime=now, **fire.notification_fields)
+             for email in emails])
+
+        if notifications and notifications[0].pk is None:
+            # The backend does not return the primary keys of bulk inserts
+            return list(cls.all_objects.filter(notification=fire, type='email',
+                                               recipient__in=emails)
+                        .values_list('id', flat=True))
+        return [notification.pk for notification in notifications]
+
+    @classmethod
+    def bulk_create_users(cls, fire, user_ids):
+        """
+        Creates one complete notification for each user of the chunk, and their
+        rows in the users through table
+        :param fire: EventNotificationFire
+        :param user_ids: chunk of user ids
+        :return:
+        """
+        now = timezone.now()
+        notifications = cls.objects.bulk_create(
+            [cls(notification=fire, owner_id=user_id, status='complete',
+                 last_update_datetime=now, **fire.notification_fields)
+             for user_id in user_ids])
+
+        if notifications and notifications[0].pk is None:
+            # The backend does not return the primary keys of bulk inserts, so
+            # the owner column links each new row to its user
+            owners = cls.all_objects.filter(notification=fire,
+                                            owner_id__in=user_ids)\
+                .values_list('id', 'owner_id')
+        else:
+            owners = [(notification.pk, notification.owner_id)
+                      for notification in notifications]
+
+        cls.users.through.objects.bulk_create(
+            [cls.users.through(notification_id=notification_id,
+                               user_id=user_id)
+             for notification_id, user_id in owners],
+            ignore_conflicts=True)
+        NotificationCounter.add(user_ids, 1)
+
+
+    @staticmethod
+    def users_have_groups():
+        """
+        Informs if the user model has the groups relation
+        :return:
+        """
+        try:
+            get_user_model()._meta.get_field('groups')
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def can_insert_group_members():
+        """
+        Informs if the members of the groups can be notified with
+        INSERT ... SELECT statements in the database
+        :return:
+        """
+        return Notification.users_have_groups() and \
+            connection.vendor in ('postgresql', 'sqlite', 'mysql')
+
+    @classmethod
+    def insert_group_members(cls, fire, group_ids, notification_id=None):
+        """
+        Notifies the members of the groups with INSERT ... SELECT statements
+        from the user groups table, so their ids never leave the database.
+        Users that already have a notification of this fire are skipped
+        :param fire: EventNotificationFire
+        :param group_ids: ids of the group recipients
+        :param notification_id: collective notification shared by the users
+        :return: number of users notified
+        """
+        quote = connection.ops.quote_name
+        groups_field = get_user_model()._meta.get_field('groups')
+        users_field = cls._meta.get_field('users')
+        group_pk = groups_field.remote_field.model._meta.pk
+        group_ids = list(set(group_pk.to_python(group) for group in group_ids))
+
+        members = "SELECT DISTINCT {user} AS user_id FROM {table} " \
+                  "WHERE {group} IN ({ids})".format(
+                      user=quote(groups_field.m2m_column_name()),
+                      table=quote(groups_field.m2m_db_table()),
+                      group=quote(groups_field.m2m_reverse_name()),
+                      ids=", ".join(["%s"] * len(group_ids)))
+        through = {"table": quote(users_field.m2m_db_table()),
+                   "notification": quote(users_field.m2m_column_name()),
+                   "user": quote(users_field.m2m_reverse_name())}
+
+        # Unread counters of the members that are going to be notified
+        members_ids = get_user_model().groups.through.objects\
+            .filter(group_id__in=group_ids).values('user_id')
+        if notification_id:
+            notified = cls.users.through.objects\
+                .filter(notification_id=notification_id).values('user_id')
+        else:
+            notified = cls.all_objects.filter(notification=fire,
+                                              owner__isnull=False)\
+                .values('owner_id')
+        NotificationCounter.add(members_ids, 1, exclude=notified)
+
+        with connection.cursor() as cursor:
+            if notification_id:
+                cursor.execute(
+                    "INSERT INTO {table} ({notification}, {user}) "
+                    "SELECT %s, m.user_id FROM ({members}) m "
+                    "WHERE NOT EXISTS (SELECT 1 FROM {table} t "
+                    "WHERE t.{notification} = %s AND t.{user} = m.user_id)"
+                    .format(members=members, **through),
+                    [notification_id] + group_ids + [notification_id])
+                return cursor.rowcount
+
+            # Every column takes the value of a new notification of the fire,
+            # but the owner, that is the member of the group
+            template = cls(notification=fire, status='complete',
+                           last_update_datetime=timezone.now(),
+                           **fire.notification_fields)
+            fields = [field for field in cls._meta.concrete_fields
+                      if not field.primary_key and field.name != 'owner']
+            table = quote(cls._meta.db_table)
+            owner = quote(cls._meta.get_field('owner').column)
+            fire_column = quote(cls._meta.get_field('notification').column)
+
+            cursor.execute(
+                "INSERT INTO {table} ({columns}, {owner}) "
+                "SELECT {values}, m.user_id FROM ({members}) m "
+                "WHERE NOT EXISTS (SELECT 1 FROM {table} n "
+                "WHERE n.{fire} = %s AND n.{owner} = m.user_id)".format(
+                    table=table, owner=owner, fire=fire_column, members=members,
+                    columns=", ".join(quote(field.column) for field in fields),
+                    values=", ".join(["%s"] * len(fields))),
+                [field.get_db_prep_save(getattr(template, field.attname),
+                                        connection)
+                 for field in fields] + group_ids + [fire.id])
+            count = cursor.rowcount
+
+            cursor.execute(
+                "INSERT INTO {table} ({notification}, {user}) "
+                "SELECT n.{pk}, n.{owner} FROM {notifications} n "
+                "WHERE n.{fire} = %s AND n.{owner} IS NOT NULL "
+                "AND NOT EXISTS (SELECT 1 FROM {table} t "
+                "WHERE t.{notification} = n.{pk})".format(
+                    pk=quote(cls._meta.pk.column), owner=owner,
+                    notifications=table, fire=fire_column, **through),
+                [fire.id])
+
+        return count
+
+class NotificationState(models.Model):
+    """
+    Reading status and importance of a collective notification for one of its
+    owners. It is only created when the owner reads or marks the notification
+    """
+    class Meta:
+        unique_together = (('user', 'notification'), )
+
+    ## Owner
+    user = models.ForeignKey(get_user_model(),
+                             on_delete=models.CASCADE,
+                             related_name="+")
+
+    ## Collective notification
+    notification = models.ForeignKey(Notification,
+                                     on_delete=models.CASCADE,
+                                     related_name="states")
+
+    ## Reading status
+    is_read = models.BooleanField(default=False)
+
+    ## Reading date
+    read_datetime = models.DateTimeField(null=True, default=None)
+
+    ## Important notification
+    is_important = models.BooleanField(default=False)
+
+    ## Date the notification was marked as important
+    important_datetime = models.DateTimeField(null=True, default=None)
+
+
+class NotificationCounter(models.Model):
+    """
+    Unread notifications of a user, updated as notifications are fired and
+    read. It is computed the first time it is requested, and the
+    reconcile_counters task corrects it periodically.
+    Its version changes with every change of the inbox of the user
+    """
+
+    ## Owner
+    user = models.OneToOneField(get_user_model(),
+                                primary_key=True,
+                                on_delete=models.CASCADE,
+                                related_name="+")
+
+    ## Unread notifications
+    unread = models.IntegerField(default=0)
+
+    ## Version of the inbox of the user, increased on every change
+    version = models.BigIntegerField(default=0)
+
+    ## Date of the last change of the inbox of the user
+    last_update_datetime = models.DateTimeField(default=timezone.now)
+
+    @staticmethod
+    def count_unread(user):
+        """
+        Counts the unread notifications of the user in the notifications table
+        :param user:
+        :return:
+        """
+        queryset = Notification.owned_by(Notification.objects.all(), user)
+        return Notification.with_user_state(queryset, user)\
+            .filter(user_is_read=False).count()
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Returns the counter of the user, creating it if it does not exist yet
+        :param user:
+        :return:
+        """
+        counter = cls.objects.filter(user_id=user.id).first()
+        if counter is None:
+            cls.objects.bulk_create(
+                [cls(user_id=user.id, unread=cls.count_unread(user))],
+                ignore_conflicts=True)
+            counter = cls.objects.get(user_id=user.id)
+        return counter
+
+    @classmethod
+    def unread_for(cls, user):
+        """
+        Returns the unread notifications of the user
+        :param user:
+        :return:
+        """
+        return cls.for_user(user).unread
+
+    @classmethod
+    def add(cls, user_ids, delta, exclude=None):
+        """
+        Adds delta to the counters of the users, increasing their version, with
+        a single UPDATE. Users without counter are skipped, it will be
+        computed when requested
+        :param user_ids: list of user ids or a queryset of them
+        :param delta:
+        :param exclude: user ids, or a queryset of them, to skip
+        :return:
+        """
+        counters = cls.objects.filter(user_id__in=user_ids)
+        if exclude is not None:
+            counters = counters.exclude(user_id__in=exclude)
+        values = {'version': models.F('version') + 1,
+                  'last_update_datetime': timezone.now()}
+        if delta < 0:
+            values['unread'] = Greatest(models.F('unread') + delta, 0)
+        elif delta > 0:
+            values['unread'] = models.F('unread') + delta
+        counters.update(**values)
+
+    @classmethod
+    def discount(cls, notification_ids):
+        """
+        Takes the notifications out of the counters of their owners before
+        they are deleted, increasing the version of every owner
+        :param notification_ids:
+        :return:
+        """
+        notifications = Notification.objects.filter(id__in=notification_ids)
+
+        # Individual notifications, grouping their owners by unread ones
+        owners = collections.defaultdict(list)
+        for owner_id, unread in notifications.filter(owner__isnull=False)\
+                .order_by().values('owner_id')\
+                .annotate(unread=models.Count('id',
+                                              filter=models.Q(is_read=False)))\
+                .values_list('owner_id', 'unread'):
+            owners[unread].append(owner_id)
+        for unread, owner_ids in owners.items():
+            cls.add(owner_ids, -unread)
+
+        # Shared notifications, counting for each counter those of its user
+        # that it has not read
+        shared = notifications.filter(owner__isnull=True).values('id')
+        user_id = models.OuterRef(models.OuterRef('user_id'))
+        audience = models.Q(user_id__in=Notification.users.through.objects
+                            .filter(notification_id__in=shared)
+                            .values('user_id'))
+        owned = models.Q(id__in=Notification.users.through.objects
+                         .filter(user_id=user_id).values('notification_id'))
+        if Notification.users_have_groups():
+            members = get_user_model().groups.through.objects
+            audience |= models.Q(user_id__in=members.filter(
+                group_id__in=Notification.groups.through.objects
+                .filter(notification_id__in=shared).values('group_id'))
+                .values('user_id'))
+            owned |= models.Q(id__in=Notification.groups.through.objects
+                              .filter(group_id__in=members
+                                      .filter(user_id=models.OuterRef(user_id))
+                                      .values('group_id'))
+                              .values('notification_id'))
+        states = NotificationState.objects.filter(
+            notification=models.OuterRef('pk'), user_id=user_id)
+        unread = notifications.filter(owner__isnull=True).filter(owned)\
+            .annotate(user_is_read=Coalesce(
+                models.Subquery(states.values('is_read')[:1]), 'is_read'))\
+            .filter(user_is_read=False).order_by()\
+            .annotate(total=models.Func(models.F('id'), function='COUNT'))\
+            .values('total')
+        cls.objects.filter(audience).update(
+            unread=Greatest(models.F('unread') -
+                            Coalesce(models.Subquery(unread), 0), 0),
+            version=models.F('version') + 1,
+            last_update_datetime=timezone.now())
+
+    @classmethod
+    def reconcile(cls, chunk_size):
+        """
+        Recomputes every counter, fixing those that have drifted
+        :param chunk_size:
+        :return: number of counters fixed
+        """
+        User = get_user_model()
+        fixed = 0
+        counters = cls.objects.order_by('user_id').values_list('user_id',
+                                                               'unread')
+        for user_id, unread in counters.iterator(chunk_size=chunk_size):
+            actual = cls.count_unread(User(pk=user_id))
+            if actual != unread:
+                cls.objects.filter(user_id=user_id).update(
+                    unread=actual, version=models.F('version') + 1,
+                    last_update_datetime=timezone.now())
+                fixed += 1
+        return fixed
+
+
+def purge_in_chunks(queryset, chunk_size, before_delete=None):
+    """
+    Deletes the rows of the queryset in chunks, each one in its own short
+    transaction, so no lock is held for long
+    :param queryset:
+    :param chunk_size:
+    :param before_delete: function called with the ids of each chunk before
+    deleting it, in its transaction
+    :return: number of rows deleted
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            if before_delete:
+                before_delete(ids)
+            model._base_manager.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+class RetentionPolicy(CommonModel):
+    """
+    Days that the fires of an event, of the events of a category, or of any
+    event, are kept. The most specific policy applies: the one of the event,
+    then the one of its category, and then the one without event and
+    category
+    """
+
+    ## Event of the policy
+    event = models.ForeignKey(Event,
+                              on_delete=models.CASCADE,
+                              related_name="retention_policies",
+                              null=True,
+                              blank=True,
+                              default=None)
+
+    ## Category of the policy, when it has no event
+    category = models.ForeignKey(Category,
+                                 on_delete=models.CASCADE,
+                                 related_name="retention_policies",
+                                 null=True,
+                                 blank=True,
+                                 default=None)
+
+    ## Days that the fires are kept
+    days = models.PositiveIntegerField()
+
+    ## Move the expired fires and notifications to the archive tables,
+    ## instead of deleting them
+    archive = models.BooleanField(default=False)
+
+    def expired_fires(self, now):
+        """
+        Complete fires older than the days of this policy, and not ruled by a
+        more specific policy
+        :param now:
+        :return:
+        """
+        fires = EventNotificationFire.all_objects.filter(
+            status='complete',
+            creation_datetime__lt=now - datetime.timedelta(days=self.days))
+        if self.event_id:
+            return fires.filter(event_notification__event_id=self.event_id)
+
+        policies = RetentionPolicy.objects.exclude(pk=self.pk)
+        fires = fires.exclude(event_notification__event_id__in=policies
+                              .filter(event__isnull=False).values('event_id'))
+        if self.category_id:
+            return fires.filter(
+                event_notification__event__category_id=self.category_id)
+        return fires.exclude(
+            event_notification__event__category_id__in=policies
+            .filter(event__isnull=True, category__isnull=False)
+            .values('category_id'))
+
+    def purge(self, chunk_size, now=None):
+        """
+        Deletes, or archives, the expired fires in chunks: first their
+        notifications and then the fires themselves
+        :param chunk_size:
+        :param now:
+        :return: number of notifications and number of fires deleted
+        """
+        fires = self.expired_fires(now or timezone.now())
+
+        def before_delete(ids):
+            # The inboxes of the owners change
+            NotificationCounter.discount(ids)
+            if self.archive:
+                ArchivedNotification.archive(ids)
+
+        notifications = purge_in_chunks(
+            Notification.all_objects.filter(notification__in=fires.values('id')),
+            chunk_size, before_delete)
+        fires = purge_in_chunks(
+            fires, chunk_size,
+            ArchivedEventNotificationFire.archive if self.archive else None)
+        return notifications, fires
+
+
+class ArchivedEventNotificationFire(models.Model):
+    """
+    Fire moved out of the inbox tables by a retention policy. Its relations are
+    kept as plain ids, so the archive does not hold the deletion of events
+    """
+
+    ## Id of the fire
+    id = models.BigIntegerField(primary_key=True)
+
+    ## Id of the event notification
+    event_notification_id = models.BigIntegerField()
+
+    ## Id of the event
+    event_id = models.BigIntegerField()
+
+    ## Subject
+    subject = models.TextField(default='')
+
+    ## Message
+    message = models.TextField()
+
+    ## Paths of the files (JSON list)
+    files = models.TextField(default='[]')
+
+    ## Creation date of the fire
+    creation_datetime = models.DateTimeField()
+
+    ## Archiving date
+    archive_datetime = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def archive(cls, ids):
+        """
+        Copies the fires to the archive with a single INSERT
+        :param ids: ids of the fires
+        :return:
+        """
+        files = collections.defaultdict(list)
+        for fire_id, path in EventNotificationFireFile.all_objects\
+                .filter(fire_id__in=ids).values_list('fire_id', 'path'):
+            files[fire_id].append(path)
+
+        fires = EventNotificationFire.all_objects.filter(id__in=ids)\
+            .select_related('event_notification', 'subject_body',
+                            'message_body')
+        cls.objects.bulk_create(
+            [cls(id=fire.id, event_notification_id=fire.event_notification_id,
+                 event_id=fire.event_notification.event_id,
+                 subject=fire.subject_text, message=fire.message_text,
+                 files=json.dumps(files[fire.id]),
+                 creation_datetime=fire.creation_datetime)
+             for fire in fires],
+            ignore_conflicts=True)
+
+
+class ArchivedNotification(models.Model):
+    """
+    Notification moved out of the inbox tables by a retention policy, with
+    its users and groups
+    """
+
+    ## Id of the notification
+    id = models.BigIntegerField(primary_key=True)
+
+    ## Id of the fire
+    fire_id = models.BigIntegerField()
+
+    ## Id of the event
+    event_id = models.BigIntegerField(null=True, default=None)
+
+    ## Id of the category
+    category_id = models.BigIntegerField(null=True, default=None)
+
+    ## Recipient, when the recipient is not an user
+    recipient = models.CharField(max_length=256, null=True, default=None)
+
+    ## Type of the recipient, when the recipient is not an user
+    type = models.CharField(max_length=64, null=True, default=None)
+
+    ## Id of the owner of an individual notification
+    owner_id = models.BigIntegerField(null=True, default=None)
+
+    ## Ids of the users (JSON list)
+    users = models.TextField(default='[]')
+
+    ## Ids of the groups (JSON list)
+    groups = models.TextField(default='[]')
+
+    ## Status
+    status = models.CharField(max_length=64)
+
+    ## Reading status
+    is_read = models.BooleanField(default=False)
+
+    ## Important notification
+    is_important = models.BooleanField(default=False)
+
+    ## Collective notification
+    collective = models.BooleanField(default=False)
+
+    ## Creation date of the notification
+    creation_datetime = models.DateTimeField()
+
+    ## Archiving date
+    archive_datetime = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def archive(cls, ids):
+        """
+        Copies the notifications, with their users and groups, to the archive
+        with a single INSERT
+        :param ids: ids of the notifications
+        :return:
+        """
+        users = collections.defaultdict(list)
+        for notification_id, user_id in Notification.users.through.objects\
+                .filter(notification_id__in=ids)\
+                .values_list('notification_id', 'user_id'):
+            users[notification_id].append(user_id)
+        groups = collections.defaultdict(list)
+        for notification_id, group_id in Notification.groups.through.objects\
+                .filter(notification_id__in=ids)\
+                .values_list('notification_id', 'group_id'):
+            groups[notification_id].append(group_id)
+
+        fields = ('id', 'recipient', 'type', 'owner_id', 'event_id',
+                  'category_id', 'status', 'is_read', 'is_important',
+                  'collective', 'creation_datetime')
+        cls.objects.bulk_create(
+            [cls(fire_id=values.pop('notification_id'),
+                 users=json.dumps(users[values['id']]),
+                 groups=json.dumps(groups[values['id']]), **values)
+             for values in Notification.all_objects.filter(id__in=ids)
+             .values('notification_id', *fields)],
+            ignore_conflicts=True)
+
+
+def invalidate_registry(sender, **kwargs):
+    """
+    Empties the event registry when its configuration changes
+    """
+    PyNot.invalidate()
+
+
+for model in (Event, Parameter, EventNotification, EventNotificationRecipient,
+              EventNotificationFile):
+    signals.post_save.connect(invalidate_registry, sender=model)
+    signals.post_delete.connect(invalidate_registry, sender=model)
+
+
+def update_notifications_category(sender, instance, **kwargs):
+    """
+    Keeps the category denormalized in the notifications of the event
+    """
+    Notification.all_objects.filter(event=instance)\
+        .exclude(category_id=instance.category_id)\
+        .update(category_id=instance.category_id)
+
+
+signals.post_save.connect(update_notifications_category, sender=Event)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Pagination of the notifications inbox
+"""
+import base64
+import heapq
+import itertools
+from collections import OrderedDict
+
+from django.db.models import Q, prefetch_related_objects
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .utils.util_settings import get_setting
+
+
+class NotificationCursorPagination(BasePagination):
+	"""
+	Cursor pagination over (creation_datetime, id), from the newest
+	notifications to the oldest ones.
+
+	Each page is read filtering by the last notification of the previous one,
+	so its cost does not depend on its depth. The total is only counted when
+	the count parameter asks for it.
+
+	The queryset may be a list of disjoint branches. Each one is read with its
+	own ordered and limited query, so it can follow its index, and their
+	pages are merged.
+	"""
+
+	## Order of the notifications, matching the owner indexes of the inbox
+	ordering = ('-creation_datetime', '-id')
+
+	cursor_query_param = 'cursor'
+	page_size_query_param = 'page_size'
+	count_query_param = 'count'
+	max_page_size = 100
+
+	def paginate_queryset(self, queryset, request, view=None):
+		"""
+		Returns the page of notifications that follows the cursor
+		:param queryset:
+		:param request:
+		:param view:
+		:return:
+		"""
+		self.request = request
+		self.page_size = self.get_page_size(request)
+		branches = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+
+		self.count = None
+		if request.query_params.get(self.count_query_param) in ('1', 'true'):
+			self.count = sum(branch.count() for branch in branches)
+
+		position = self.decode_cursor(request)
+		pages = []
+		for branch in branches:
+			# Related objects are only prefetched for the merged page
+			branch = branch.order_by(*self.ordering).prefetch_related(None)
+			if position:
+				created, pk = position
+				# The first condition lets the index seek to the cursor
+				branch = branch.filter(creation_datetime__lte=created).filter(
+					Q(creation_datetime__lt=created) |
+					Q(creation_datetime=created, id__lt=pk))
+			# One more notification is read to know if there is a next page
+			pages.append(list(branch[:self.page_size + 1]))
+
+		page = list(itertools.islice(
+			heapq.merge(*pages, key=lambda notification: (
+				notification.creation_datetime, notification.id), reverse=True),
+			self.page_size + 1))
+		self.has_next = len(page) > self.page_size
+		page = page[:self.page_size]
+		prefetch_related_objects(page, *branches[0]._prefetch_related_lookups)
+		self.next_position = None
+		if self.has_next:
+			self.next_position = (page[-1].creation_datetime, page[-1].id)
+		return page
+
+	def get_page_size(self, request):
+		"""
+		Requested page size, limited to max_page_size
+		:param request:
+		:return:
+		"""
+		try:
+			page_size = int(request.query_params[self.page_size_query_param])
+		except (KeyError, ValueError):
+			return get_setting("PYNOT_PAGE_SIZE")
+		return max(1, min(page_size, self.max_page_size))
+
+	def decode_cursor(self, request):
+		"""
+		Returns the position (creation_datetime, id) encoded in the cursor
+		:param request:
+		:return:
+		"""
+		encoded = request.query_params.get(self.cursor_query_param)
+		if not encoded:
+			return None
+		try:
+			created, pk = base64.urlsafe_b64decode(encoded.encode('ascii'))\
+				.decode('ascii').split('|')
+			created = parse_datetime(created)
+			pk = int(pk)
+		except (TypeError, ValueError, UnicodeError):
+			created = None
+		if created is None:
+			raise NotFound("Invalid cursor")
+		return created, pk
+
+	def encode_cursor(self, position):
+		"""
+		Encodes the position (creation_datetime, id) in a cursor
+		:param position:
+		:return:
+		"""
+		created, pk = position
+		return base64.urlsafe_b64encode(
+			"{0}|{1}".format(created.isoformat(), pk).encode('ascii'))\
+			.decode('ascii')
+
+	def get_next_link(self):
+		if self.next_position is None:
+			return None
+		url = self.request.build_absolute_uri()
+		url = remove_query_param(url, self.count_query_param)
+		return replace_query_param(url, self.cursor_query_param,
+								   self.encode_cursor(self.next_position))
+
+	def get_paginated_response(self, data):
+		response = OrderedDict([('next', self.get_next_link())])
+		if self.count is not None:
+			response['count'] = self.count
+		response['results'] = data
+		return Response(response)
+
+	def get_paginated_response_schema(self, schema):
+		return {
+			'type': 'object',
+			'properties': {
+				'next': {'type': 'string', 'nullable': True},
+				'count': {'type': 'integer'},
+				'results': schema,
+			},
+		}
@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission
 
+from .models import Notification
+
 
 class IsNotificationOwner(BasePermission):
 	"""
@@ -7,4 +9,5 @@ class IsNotificationOwner(BasePermission):
 	"""
 
 	def has_object_permission(self, request, view, obj):
-		return obj.users.filter(user=request.user).exists()
\ No newline at end of file
+		queryset = Notification.objects.filter(pk=obj.pk)
+		return Notification.owned_by(queryset, request.user).exists()
\ No newline at end of file
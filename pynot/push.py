@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Push delivery of in-app notifications
+"""
+import collections
+import functools
+import queue
+import threading
+
+from django.utils.module_loading import import_string
+
+from .utils.util_settings import get_setting
+
+
+class Broker(object):
+	"""
+	Interface of the push brokers.
+
+	Messages are published to channels: "user:<id>" for the owners of the
+	notifications, and "group:<id>" for the members of the groups whose
+	notifications are written by reference.
+	"""
+
+	def publish(self, channels, payload):
+		"""
+		Publishes the payload to every channel
+		:param channels: list of channel names
+		:param payload: dict serializable as JSON
+		:return:
+		"""
+		raise NotImplementedError
+
+	def listen(self, channels, timeout):
+		"""
+		Subscribes to the channels at once, and returns a generator of the
+		payloads published to them. It yields None after timeout seconds
+		without messages, so the caller can send a heartbeat or stop, and
+		unsubscribes when it is closed
+		:param channels: list of channel names
+		:param timeout: seconds
+		:return:
+		"""
+		raise NotImplementedError
+
+
+class LocalBroker(Broker):
+	"""
+	In-memory broker. Messages only reach the listeners of the same process,
+	so it is meant for tests and development servers
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		## Queues of the listeners of each channel
+		self._listeners = collections.defaultdict(set)
+
+	def publish(self, channels, payload):
+		with self._lock:
+			listeners = set()
+			for channel in channels:
+				listeners.update(self._listeners.get(channel, ()))
+		# Each listener receives the payload once, whatever its channels
+		for messages in listeners:
+			messages.put(payload)
+
+	def listen(self, channels, timeout):
+		messages = queue.Queue()
+		with self._lock:
+			for channel in channels:
+				self._listeners[channel].add(messages)
+		return self._receive(messages, channels, timeout)
+
+	def _receive(self, messages, channels, timeout):
+		try:
+			while True:
+				try:
+					yield messages.get(timeout=timeout)
+				except queue.Empty:
+					yield None
+		finally:
+			with self._lock:
+				for channel in channels:
+					self._listeners[channel].discard(messages)
+					if not self._listeners[channel]:
+						del self._listeners[channel]
+
+
+@functools.lru_cache(maxsize=None)
+def load_broker(class_name):
+	"""
+	Returns the broker of the class, created once per process
+	:param class_name:
+	:return:
+	"""
+	return import_string(class_name)()
+
+
+def get_broker():
+	"""
+	Returns the broker of the PYNOT_PUSH_BROKER setting, or None when push
+	delivery is disabled
+	:return:
+	"""
+	class_name = get_setting("PYNOT_PUSH_BROKER")
+	if not class_name:
+		return None
+	return load_broker(class_name)
+
+
+def user_channels(user):
+	"""
+	Channels listened by the user: its own one and those of its groups
+	:param user:
+	:return:
+	"""
+	channels = ["user:{0}".format(user.id)]
+	if hasattr(user, 'groups'):
+		channels += ["group:{0}".format(group_id)
+					 for group_id in user.groups.values_list('id', flat=True)]
+	return channels
@@ -3,6 +3,7 @@
 Serializador para expedientes
 """
 from drf_writable_nested import WritableNestedModelSerializer
+from rest_framework import serializers
 from . import models
 
 class DynamicFieldModelSerializer(WritableNestedModelSerializer):
@@ -30,6 +31,10 @@ class EventNotificationFireSimpleSerializer(DynamicFieldModelSerializer):
     """
     Notification event fire serializer
     """
+    ## Subject and message, from the body store when they are stored there
+    subject = serializers.CharField(source='subject_text', read_only=True)
+    message = serializers.CharField(source='message_text', read_only=True)
+
     class Meta(object):
         model = models.EventNotificationFire
         fields = ('id', 'subject', 'message', 'creation_datetime')
@@ -41,17 +46,39 @@ class NotificationSerializer(DynamicFieldModelSerializer):
     """
     notification = EventNotificationFireSimpleSerializer()
 
+    ## Reading status and importance for the requesting user
+    is_read = serializers.SerializerMethodField()
+    is_important = serializers.SerializerMethodField()
+
+    def get_is_read(self, obj):
+        return getattr(obj, 'user_is_read', obj.is_read)
+
+    def get_is_important(self, obj):
+        return getattr(obj, 'user_is_important', obj.is_important)
+
     class Meta(object):
         model = models.Notification
         fields = ('id', 'notification', 'recipient', 'type',
                   'status', 'is_read', 'is_important')
 
+class NotificationStateSerializer(serializers.Serializer):
+    """
+    Notifications to mark as read or as important
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                allow_empty=False)
+    is_important = serializers.BooleanField(default=True)
+
 class EventNotificationFireSerializer(DynamicFieldModelSerializer):
     """
     Notification event fire serializer
     """
     notifications = NotificationSerializer()
 
+    ## Subject and message, from the body store when they are stored there
+    subject = serializers.CharField(source='subject_text', read_only=True)
+    message = serializers.CharField(source='message_text', read_only=True)
+
     class Meta(object):
         model = models.EventNotificationFire
         fields = ('id', 'notifications', 'subject', 'message')
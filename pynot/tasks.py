@@ -1,6 +1,10 @@
 # coding=utf-8
+import datetime
+
 from celery import shared_task
-from .utils.util_email import send_email
+from django.utils import timezone
+from .utils import util_email
+from .utils.util_settings import get_setting
 
 @shared_task(bind=True, name='pynot.tasks.send_email')
 def send_email(self, not_id):
@@ -22,16 +26,16 @@ def send_email(self, not_id):
         if notification.type=='email' and notification.status=='pending':
             print("pynot.tasks.send_email (not_id={0}): email and pending".format(not_id))
             notification_fire = notification.notification
-            subject = notification_fire.subject
-            message = notification_fire.message
+            subject = notification_fire.subject_text
+            message = notification_fire.message_text
             print("pynot.tasks.send_email (not_id={0}): send_email".format(not_id))
-            send_email(to_email=notification.recipient,
+            util_email.send_email(to_email=notification.recipient,
                        subject=subject,
                        template=Config.load().email_template,
                        context={'message':message},
                        smtp_config_name='pynot')
             print("pynot.tasks.send_email (not_id={0}): sended".format(not_id))
-            notification.status='completed'
+            notification.status='complete'
             notification.save()
             print("pynot.tasks.send_email (not_id={0}): status completed".format(not_id))
 
@@ -40,3 +44,210 @@ def send_email(self, not_id):
     except Exception as e:
         print("pynot.tasks.send_email (not_id={0}): Exception({1})".format(not_id, e))
         self.retry(countdown=10, max_retries=120, exc=Exception())
+
+
+@shared_task(bind=True, name='pynot.tasks.send_email_batch')
+def send_email_batch(self, not_ids):
+    """
+    Envía un bloque de notificaciones por email usando una única conexión SMTP
+    :param self: task  tarea celery
+    :param not_ids: list  ids de las Notification
+    :return: void
+    """
+
+    print("pynot.tasks.send_email_batch: {0} notifications. Retry={1}"
+          .format(len(not_ids), self.request.retries))
+
+    # Importar modelos dentro de la función que se va a encolar para evitar dependencias circulares
+    from pynot.models import Notification, Config
+
+    notifications = list(Notification.objects
+                         .select_related('notification__subject_body',
+                                         'notification__message_body')
+                         .filter(pk__in=not_ids, type='email', status='pending'))
+    if not notifications:
+        return
+
+    template = Config.load().email_template
+    try:
+        results = util_email.send_emails([
+            {'to_email': notification.recipient,
+             'subject': notification.notification.subject_text,
+             'template': template,
+             'context': {'message': notification.notification.message_text},
+             'smtp_config_name': 'pynot'}
+            for notification in notifications], smtp_config_name='pynot')
+    except Exception as e:
+        # Sin conexión SMTP no se ha enviado ninguna: se reintenta el bloque completo
+        print("pynot.tasks.send_email_batch: Exception({0})".format(e))
+        raise self.retry(args=([notification.id for notification in notifications],),
+                         countdown=10, max_retries=120, exc=e)
+
+    sent = []
+    failed = []
+    for notification, error in zip(notifications, results):
+        if error is None:
+            sent.append(notification.id)
+        else:
+            print("pynot.tasks.send_email_batch (not_id={0}): Exception({1})"
+                  .format(notification.id, error))
+            failed.append(notification.id)
+
+    Notification.objects.filter(pk__in=sent)\
+        .update(status='complete', last_update_datetime=timezone.now())
+
+    if failed:
+        # Sólo se reintentan las notificaciones que no se han enviado
+        raise self.retry(args=(failed,), countdown=10, max_retries=120)
+
+
+@shared_task(name='pynot.tasks.fire_event')
+def fire_event(event_slug, data):
+    """
+    Expande los parámetros serializados de un evento y encola el disparo de
+    cada una de sus notificaciones
+    :param event_slug: str  slug del Event
+    :param data: dict  parámetros serializados con Event.serialize_params
+    :return: void
+    """
+
+    from pynot.models import Event, PyNot
+
+    event = PyNot.event(event_slug)
+    notifications = event.hydrated_notifications()
+    expanded = Event.expand_params(data,
+                                   paths=event.referenced_paths(notifications))
+    for notification in notifications:
+        fire_event_notification.delay(event_slug, notification.id, expanded)
+
+
+@shared_task(name='pynot.tasks.fire_event_notification')
+def fire_event_notification(event_slug, notification_id, expanded):
+    """
+    Crea el disparo de una notificación y encola un fire_recipients por cada
+    bloque de destinatarios
+    :param event_slug: str  slug del Event
+    :param notification_id: int  id del EventNotification
+    :param expanded: dict  parámetros expandidos con Event.expand_params
+    :return: void
+    """
+
+    from pynot.models import EventNotification, PyNot
+
+    # La serialización de la tarea convierte las tuplas en listas
+    expanded = {field: tuple(value) if isinstance(value, list) else value
+                for field, value in expanded.items()}
+    notification = next(
+        (notification for notification
+         in PyNot.event(event_slug).hydrated_notifications()
+         if notification.id == notification_id), None)
+    if notification is None:
+        # El registro de este proceso es anterior a la notificación, que se
+        # ha creado en otro proceso. Si no existe, la tarea falla
+        PyNot.discard(event_slug)
+        notification = EventNotification.objects.select_related('event')\
+            .prefetch_related('recipients', 'files').get(pk=notification_id)
+    notification.fire(expanded, defer=True)
+
+
+@shared_task(name='pynot.tasks.fire_recipients')
+def fire_recipients(fire_id, emails=(), users=(), notification_id=None):
+    """
+    Crea las notificaciones de un bloque de destinatarios de un disparo
+    :param fire_id: int  id del EventNotificationFire
+    :param emails: list  bloque de emails
+    :param users: list  bloque de ids de usuario
+    :param notification_id: int  id de la notificación colectiva, si la hay
+    :return: void
+    """
+
+    from django.db import transaction
+    from pynot.models import EventNotificationFire
+
+    with transaction.atomic():
+        fire = EventNotificationFire.objects\
+            .select_related('event_notification__event').get(pk=fire_id)
+        # El bloque puede haberse escrito ya en un reintento o al reanudar el
+        # disparo: el bloqueo del disparo evita escribirlo a la vez
+        fire.lock()
+        fire.notify(emails, users, notification_id, skip_notified=True)
+        fire.chunk_done()
+
+
+@shared_task(name='pynot.tasks.resume_fires')
+def resume_fires():
+    """
+    Reanuda las difusiones que llevan más de PYNOT_FIRE_RESUME_AFTER segundos
+    sin progresar, por ejemplo porque el worker que las ejecutaba ha muerto.
+    Las diferidas progresan con cada bloque encolado o escrito, por lo que
+    sólo se reanudan si ninguno de sus bloques se ha escrito en ese tiempo.
+    Debe programarse periódicamente con celery beat
+    :return: void
+    """
+
+    from pynot.models import EventNotificationFire
+
+    limit = timezone.now() - datetime.timedelta(
+        seconds=get_setting("PYNOT_FIRE_RESUME_AFTER"))
+    fires = EventNotificationFire.objects.filter(
+        status__in=('pending', 'in_process'), last_update_datetime__lt=limit)
+    for fire in fires.iterator():
+        # Se reclama el disparo, para que no lo reanuden otros workers a la vez
+        claimed = EventNotificationFire.objects.filter(
+            pk=fire.id, status=fire.status,
+            last_update_datetime=fire.last_update_datetime)\
+            .update(last_update_datetime=timezone.now())
+        if not claimed:
+            continue
+        print("pynot.tasks.resume_fires: fire_id={0} cursor={1}"
+              .format(fire.id, fire.cursor))
+        fire.deliver(resume=True)
+
+
+@shared_task(name='pynot.tasks.reconcile_counters')
+def reconcile_counters():
+    """
+    Recalcula los contadores de notificaciones no leídas, corrigiendo los que
+    se hayan desviado, por ejemplo por notificaciones borradas o por usuarios
+    que se han unido a un grupo. Debe programarse periódicamente con celery
+    beat
+    :return: void
+    """
+
+    from pynot.models import NotificationCounter
+
+    fixed = NotificationCounter.reconcile(get_setting("PYNOT_BULK_CHUNK_SIZE"))
+    print("pynot.tasks.reconcile_counters: fixed={0}".format(fixed))
+
+
+@shared_task(name='pynot.tasks.purge_notifications')
+def purge_notifications():
+    """
+    Elimina, o archiva, los disparos caducados según las políticas de
+    retención, las notificaciones borradas lógicamente hace más de
+    PYNOT_ERASED_RETENTION_DAYS días y los asuntos y mensajes que ya no usa
+    ningún disparo. Se borra por bloques, cada uno en su
+    propia transacción. Debe programarse periódicamente con celery beat
+    :return: void
+    """
+
+    from pynot.models import Notification, NotificationBody, RetentionPolicy, \
+        purge_in_chunks
+
+    chunk_size = get_setting("PYNOT_PURGE_CHUNK_SIZE")
+    for policy in RetentionPolicy.objects.all():
+        notifications, fires = policy.purge(chunk_size)
+        print("pynot.tasks.purge_notifications: policy_id={0} notifications={1} "
+              "fires={2}".format(policy.id, notifications, fires))
+
+    days = get_setting("PYNOT_ERASED_RETENTION_DAYS")
+    if days is not None:
+        limit = timezone.now() - datetime.timedelta(days=days)
+        erased = purge_in_chunks(
+            Notification.all_objects.filter(is_erased=True,
+                                            last_update_datetime__lt=limit),
+            chunk_size)
+        print("pynot.tasks.purge_notifications: erased={0}".format(erased))
+
+    bodies = NotificationBody.purge_orphans(chunk_size)
+    print("pynot.tasks.purge_notifications: bodies={0}".format(bodies))
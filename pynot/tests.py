@@ -1,4 +1,15 @@
-from django.test import TestCase
+import datetime
+import json
+from unittest import mock, skipUnless
+
+from django.core import mail
+from django.urls import reverse
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib.auth.models import Group
 
 from pynot.models import *
 from pynot.factories import *
@@ -6,6 +17,11 @@ from rest_assured.testcases import *
 from django.contrib.auth import get_user_model
 from rest_framework.authtoken.models import Token
 from rest_framework import serializers
+from rest_framework.test import APIClient
+from pynot import push, tasks
+from pynot.utils import util_email
+from pynot.utils.util_placeholder import PlaceholderTemplate
+from pynot.views import NotificationFilter, NotificationView
 
 
 
@@ -149,6 +165,24 @@ class ParameterTestCase(TestCase):
         self.assertEqual(data_group["events"]["data"]["id"]["human_name"],
                          "ID")
 
+    def test_get_serializer_schemas_memoized(self):
+        self.parameter.data_body
+        with mock.patch.object(Parameter, 'get_schemas') as get_schemas:
+            for obj_type in ('body', 'email', 'user', 'group', 'file'):
+                getattr(self.parameter, 'data_' + obj_type)
+        get_schemas.assert_not_called()
+
+    def test_serialize_params_pruned(self):
+        paths = self.event.referenced_paths()
+        with self.assertNumQueries(3):
+            data = self.event.serialize_params({'param_name': self.category},
+                                               paths)
+        self.assertEqual(data, {'param_name': {
+            'name': 'cat_name',
+            'events': [{'parameters': [{'name': 'param_name'}]},
+                       {'parameters': [{'name': 'param_name2'},
+                                       {'name': 'param_name3'}]}]}})
+
     def test_fire(self):
 
         self.event.fire(param_name=CategoryTestSerializer(self.category))
@@ -164,6 +198,962 @@ class ParameterTestCase(TestCase):
 
 
 
+class GroupTestSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Group
+        fields = ('id', 'name')
+        extra_fields_group = ('id',)
+
+
+class FireTestCase(TestCase):
+    event = None
+    notification = None
+    group = None
+    users = None
+
+    def setUp(self):
+        self.group = Group.objects.create(name='group')
+        self.users = [get_user_model().objects.create_user(
+            username='user{}'.format(i), email='user{}@example.com'.format(i))
+            for i in range(3)]
+        self.group.user_set.add(self.users[0], self.users[1])
+
+        self.event = EventFactory.create(slug='group_event')
+        ParameterFactory.create(event=self.event, name='group',
+                                serializer='pynot.tests.GroupTestSerializer')
+        self.notification = EventNotificationFactory.create(event=self.event,
+            subject='Hello group.name', message='Message for group.name')
+        EventNotificationRecipientFactory.create(
+            notification=self.notification, recipient='group.id', type='group')
+
+    @override_settings(PYNOT_BULK_CHUNK_SIZE=1, PYNOT_FIRE_ATOMIC='chunk')
+    def test_fire_individual(self):
+        self.event.fire(group=self.group)
+
+        fire = EventNotificationFire.objects.get()
+        self.assertEqual(fire.subject, 'Hello group')
+        notifications = Notification.objects.filter(notification=fire)
+        self.assertEqual(notifications.count(), 2)
+        for notification in notifications:
+            self.assertEqual(list(notification.users.values_list('id', flat=True)),
+                             [notification.owner_id])
+        self.assertEqual(Notification.users.through.objects.count(), 2)
+
+    def test_fire_collective(self):
+        self.notification.collective = True
+        self.notification.save()
+
+        self.event.fire(group=self.group)
+
+        notification = Notification.objects.get()
+        self.assertEqual(set(notification.users.values_list('id', flat=True)),
+                         {self.users[0].id, self.users[1].id})
+
+    @override_settings(PYNOT_BULK_CHUNK_SIZE=1)
+    def test_fire_async(self):
+        with mock.patch.object(tasks.fire_event, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.event.fire_async(group=self.group)
+        self.assertFalse(EventNotificationFire.objects.exists())
+        (event_slug, data), kwargs = delay.call_args
+
+        with mock.patch.object(tasks.fire_event_notification, 'delay',
+                               tasks.fire_event_notification), \
+                mock.patch.object(tasks.fire_recipients, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            tasks.fire_event(event_slug, data)
+        self.assertEqual(delay.call_count, 2)
+        self.assertFalse(Notification.objects.exists())
+
+        fire = EventNotificationFire.objects.get()
+        self.assertEqual((fire.status, fire.pending_chunks), ('in_process', 2))
+
+        for args, kwargs in delay.call_args_list:
+            tasks.fire_recipients(*args, **kwargs)
+        self.assertEqual(Notification.objects.count(), 2)
+        fire.refresh_from_db()
+        self.assertEqual((fire.status, fire.pending_chunks, fire.recipients),
+                         ('complete', 0, ''))
+
+    @override_settings(PYNOT_BULK_CHUNK_SIZE=1)
+    def test_resume_deferred_fire(self):
+        with mock.patch.object(tasks.fire_recipients, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.notification.fire({'group.id': str(self.group.id)},
+                                   defer=True)
+        (first, second) = delay.call_args_list
+
+        # The second chunk is lost
+        tasks.fire_recipients(*first[0], **first[1])
+        fire = EventNotificationFire.objects.get()
+        self.assertEqual(fire.status, 'in_process')
+
+        EventNotificationFire.objects.update(
+            last_update_datetime=timezone.now() - datetime.timedelta(days=1))
+        with mock.patch('builtins.print'):
+            tasks.resume_fires()
+        fire.refresh_from_db()
+        self.assertEqual(fire.status, 'complete')
+        self.assertEqual(sorted(Notification.objects
+                                .values_list('owner_id', flat=True)),
+                         [self.users[0].id, self.users[1].id])
+
+        self.assertEqual(fire.pending_chunks, 0)
+
+        # A chunk delivered late is not written twice, nor counted
+        with mock.patch.object(EventNotificationFire, 'lock') as lock:
+            tasks.fire_recipients(*second[0], **second[1])
+        lock.assert_called_once_with()
+        self.assertEqual(Notification.objects.count(), 2)
+        fire.refresh_from_db()
+        self.assertEqual((fire.status, fire.pending_chunks), ('complete', 0))
+
+    @override_settings(PYNOT_DB_FANOUT=True)
+    def test_fire_db_fanout(self):
+        self.event.fire(group=self.group)
+        notifications = Notification.objects.all()
+        self.assertEqual(set(notifications.values_list('owner_id', flat=True)),
+                         {self.users[0].id, self.users[1].id})
+        for notification in notifications:
+            self.assertEqual(notification.status, 'complete')
+            self.assertEqual(list(notification.users.values_list('id', flat=True)),
+                             [notification.owner_id])
+
+        self.notification.collective = True
+        self.notification.save()
+        fire = PyNot.event('group_event').notifications.get().fire(
+            {'group.id': str(self.group.id)})
+        notification = Notification.objects.get(notification=fire)
+        self.assertEqual(set(notification.users.values_list('id', flat=True)),
+                         {self.users[0].id, self.users[1].id})
+
+    def test_insert_group_members_skips_notified(self):
+        fire = EventNotificationFire.objects.create(
+            event_notification=self.notification, message='')
+        Notification.bulk_create_users(fire, [self.users[0].id])
+
+        # Unread counters, notifications and their users
+        with self.assertNumQueries(3):
+            count = Notification.insert_group_members(fire, [str(self.group.id)])
+        self.assertEqual(count, 1)
+        self.assertEqual(Notification.objects.filter(notification=fire).count(), 2)
+        self.assertEqual(Notification.users.through.objects.count(), 2)
+
+    @override_settings(PYNOT_COLLECTIVE_GROUPS=True)
+    def test_fire_collective_groups(self):
+        self.notification.collective = True
+        self.notification.save()
+
+        self.event.fire(group=self.group)
+
+        notification = Notification.objects.get()
+        self.assertEqual(list(notification.groups.all()), [self.group])
+        self.assertFalse(Notification.users.through.objects.exists())
+
+        client = APIClient()
+        for user, count in ((self.users[0], 1), (self.users[2], 0)):
+            client.force_authenticate(user)
+            response = client.get(reverse('notification-list'))
+            self.assertEqual(len(response.data['results']), count)
+            response = client.get(reverse('notification-read-pending'))
+            self.assertEqual(response.data['unread'], count)
+
+    @override_settings(PYNOT_COLLECTIVE_GROUPS=True)
+    def test_collective_groups_counter(self):
+        self.notification.collective = True
+        self.notification.save()
+        EventNotificationRecipientFactory.create(
+            notification=self.notification, recipient='user.ids', type='user')
+        counters = [NotificationCounter.for_user(user) for user in self.users]
+
+        # users[0] is both a member of the group and a direct recipient
+        self.notification.fire({'group.id': str(self.group.id),
+                                'user.ids': (str(self.users[0].id),
+                                             str(self.users[2].id))})
+        for counter in counters:
+            counter.refresh_from_db()
+        self.assertEqual([counter.unread for counter in counters], [1, 1, 1])
+
+    def test_collective_read_state(self):
+        self.notification.collective = True
+        self.notification.save()
+
+        self.event.fire(group=self.group)
+        notification = Notification.objects.get()
+        self.assertTrue(notification.collective)
+
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-detail',
+                                      args=[notification.id]))
+        self.assertTrue(response.data['is_read'])
+        response = client.patch(reverse('notification-important',
+                                        args=[notification.id]))
+        self.assertTrue(response.data['is_important'])
+        response = client.get(reverse('notification-read-pending'))
+        self.assertEqual(response.data['unread'], 0)
+
+        client.force_authenticate(self.users[1])
+        response = client.get(reverse('notification-read-pending'))
+        self.assertEqual(response.data['unread'], 1)
+        response = client.get(reverse('notification-list'),
+                              {'is_important': 'true'})
+        self.assertEqual(len(response.data['results']), 0)
+
+        notification.refresh_from_db()
+        self.assertFalse(notification.is_read)
+        self.assertEqual(notification.states.get().user, self.users[0])
+
+    def test_unread_counter(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-read-pending'))
+        self.assertEqual(response.data['unread'], 0)
+        counter = NotificationCounter.objects.get(user=self.users[0])
+
+        self.event.fire(group=self.group)
+        with override_settings(PYNOT_DB_FANOUT=True):
+            self.event.fire(group=self.group)
+        counter.refresh_from_db()
+        self.assertEqual(counter.unread, 2)
+        self.assertFalse(NotificationCounter.objects.filter(
+            user=self.users[1]).exists())
+
+        notification = Notification.owned_by(Notification.objects.all(),
+                                              self.users[0]).first()
+        client.get(reverse('notification-detail', args=[notification.id]))
+        client.get(reverse('notification-detail', args=[notification.id]))
+        with self.assertNumQueries(1):
+            response = client.get(reverse('notification-read-pending'))
+        self.assertEqual(response.data['unread'], 1)
+
+        NotificationCounter.objects.update(unread=5)
+        tasks.reconcile_counters()
+        counter.refresh_from_db()
+        self.assertEqual(counter.unread, 1)
+
+    def test_mark_read(self):
+        self.event.fire(group=self.group)
+        self.notification.collective = True
+        self.notification.save()
+        self.event.fire(group=self.group)
+
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        client.get(reverse('notification-read-pending'))
+        ids = list(Notification.owned_by(Notification.objects.all(),
+                                         self.users[0])
+                   .values_list('id', flat=True))
+        self.assertEqual(len(ids), 2)
+
+        response = client.post(reverse('notification-mark-important'),
+                               {'ids': ids}, format='json')
+        self.assertEqual(response.data['count'], 2)
+        response = client.post(reverse('notification-mark-read'),
+                               {'ids': ids[:1]}, format='json')
+        self.assertEqual(response.data['count'], 1)
+        # Former names of the filters are still accepted
+        response = client.get(
+            reverse('notification-list') +
+            '?notification__event_notification__event_id={}'.format(self.event.id + 1))
+        self.assertEqual(response.data['results'], [])
+        response = client.get(
+            reverse('notification-list') +
+            '?notification__event_notification__event__category_id={}'
+            .format(self.event.category_id))
+        self.assertEqual(len(response.data['results']), 2)
+        response = client.post(reverse('notification-mark-all-read') +
+                               '?event={}'.format(self.event.id))
+        self.assertEqual(response.data['count'], 1)
+        response = client.post(reverse('notification-mark-all-read'))
+        self.assertEqual(response.data['count'], 0)
+        response = client.get(reverse('notification-read-pending'))
+        self.assertEqual(response.data['unread'], 0)
+
+        response = client.get(reverse('notification-list'))
+        for notification in response.data['results']:
+            self.assertTrue(notification['is_read'])
+            self.assertTrue(notification['is_important'])
+
+        client.force_authenticate(self.users[1])
+        response = client.get(reverse('notification-read-pending'))
+        self.assertEqual(response.data['unread'], 2)
+        response = client.post(reverse('notification-mark-read'),
+                               {'ids': ids}, format='json')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_inbox_pagination(self):
+        for i in range(3):
+            self.event.fire(group=self.group)
+        Notification.objects.update(creation_datetime=timezone.now())
+        # A shared notification between the individual ones
+        self.notification.collective = True
+        self.notification.save()
+        self.event.fire(group=self.group)
+        Notification.objects.filter(collective=True).update(
+            creation_datetime=timezone.now() - datetime.timedelta(days=1))
+        Notification.objects.filter(collective=False).order_by('id').first()\
+            .update(creation_datetime=timezone.now() - datetime.timedelta(days=2))
+
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-list'),
+                              {'page_size': 2, 'count': 'true'})
+        self.assertEqual(response.data['count'], 4)
+        ids = [notification['id'] for notification in response.data['results']]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(response.data['next'])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'COUNT(' in query['sql']])
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+        ids += [notification['id'] for notification in response.data['results']]
+        shared = Notification.objects.get(collective=True).id
+        oldest = Notification.objects.filter(collective=False).order_by('id')\
+            .first().id
+        self.assertEqual(ids[2:], [shared, oldest])
+        self.assertEqual(ids[:2], sorted(ids[:2], reverse=True))
+
+        response = client.get(reverse('notification-list'), {'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_inbox_denormalized(self):
+        self.event.fire(group=self.group)
+        notifications = Notification.objects.all()
+        self.assertEqual(set(notifications.values_list('event', 'category')),
+                         {(self.event.id, self.event.category_id)})
+
+        category = CategoryFactory.create()
+        self.event.category = category
+        self.event.save()
+        self.assertEqual(set(notifications.values_list('category', flat=True)),
+                         {category.id})
+
+        queryset = NotificationFilter({'event': self.event.id,
+                                       'category': category.id},
+                                      queryset=notifications).qs
+        self.assertNotIn('JOIN', str(queryset.query))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(queryset), 2)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_inbox_query_plans(self):
+        for i in range(3):
+            self.event.fire(group=self.group)
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        next_page = client.get(reverse('notification-list'),
+                               {'page_size': 1}).data['next']
+
+        def plans(url, params=None):
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url, params)
+            with connection.cursor() as cursor:
+                for query in queries.captured_queries:
+                    if query['sql'].startswith('SELECT') and \
+                            'FROM "pynot_notification" ' in query['sql']:
+                        cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                        yield '\n'.join(str(row) for row in cursor.fetchall())
+
+        # Individual and shared notifications, each branch in inbox order
+        # from its owner index, also in deep pages
+        for url, params, index in (
+                (reverse('notification-list'), None, 'pynot_notif_owner_inbox'),
+                (next_page, None, 'pynot_notif_owner_inbox'),
+                (reverse('notification-list'), {'event': self.event.id},
+                 'pynot_notif_owner_event_inbox'),
+                (reverse('notification-list'),
+                 {'category': self.event.category_id},
+                 'pynot_notif_owner_categ_inbox')):
+            branches = list(plans(url, params))
+            self.assertEqual(len(branches), 2)
+            for plan in branches:
+                self.assertIn('USING INDEX {} (owner_id=?'.format(index), plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+            if url == next_page:
+                self.assertIn('creation_datetime<?', branches[0])
+
+    def test_inbox_queries(self):
+        for i in range(3):
+            self.event.fire(group=self.group)
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        NotificationCounter.for_user(self.users[0])
+
+        # Inbox version, and page of the individual and of the shared
+        # notifications
+        for page_size in (1, 3):
+            with self.assertNumQueries(3):
+                response = client.get(reverse('notification-list'),
+                                      {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+
+        for i in range(3):
+            ParameterFactory.create(event=self.event, name='param{}'.format(i),
+                                    serializer='pynot.tests.GroupTestSerializer')
+            EventNotificationFactory.create(event=self.event)
+            EventFactory.create(category=self.event.category)
+        with self.assertNumQueries(3):
+            response = client.get(reverse('event-detail', args=[self.event.id]))
+        self.assertEqual(len(response.data['notifications']), 4)
+        with self.assertNumQueries(2):
+            response = client.get(reverse('category-detail',
+                                          args=[self.event.category_id]))
+        self.assertEqual(len(response.data['events']), 4)
+
+    def test_inbox_conditional_get(self):
+        self.event.fire(group=self.group)
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-list'))
+        etag = response['ETag']
+        notification_id = response.data['results'][0]['id']
+
+        with self.assertNumQueries(1):
+            response = client.get(reverse('notification-list'),
+                                  HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Reading, marking and firing change the version of the inbox
+        client.get(reverse('notification-detail', args=[notification_id]))
+        client.patch(reverse('notification-important', args=[notification_id]))
+        self.event.fire(group=self.group)
+        response = client.get(reverse('notification-list'),
+                              HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(NotificationCounter.objects.get(
+            user=self.users[0]).version, 3)
+
+    @override_settings(PYNOT_INBOX_CACHE='default')
+    def test_inbox_cache(self):
+        self.event.fire(group=self.group)
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-list'))
+
+        with self.assertNumQueries(1):
+            cached = client.get(reverse('notification-list'))
+        self.assertEqual(cached.data, response.data)
+
+        response = client.get(reverse('notification-list'), {'is_read': 'true'})
+        self.assertEqual(response.data['results'], [])
+
+        client.post(reverse('notification-mark-all-read'))
+        response = client.get(reverse('notification-list'))
+        self.assertTrue(response.data['results'][0]['is_read'])
+
+    @override_settings(PYNOT_PUSH_BROKER='pynot.push.LocalBroker',
+                       PYNOT_PUSH_HEARTBEAT=0.01)
+    def test_push_stream(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-stream'),
+                              HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b': connected\n\n')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.fire(group=self.group)
+        fire = EventNotificationFire.objects.get()
+        self.assertEqual(json.loads(next(events).decode()[len('data: '):]),
+                         {'fire': fire.id, 'event': self.event.id,
+                          'subject': 'Hello group'})
+        self.assertEqual(next(events), b': heartbeat\n\n')
+
+        # Members of the groups notified by the database listen to them
+        with override_settings(PYNOT_DB_FANOUT=True), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.event.fire(group=self.group)
+        fire = EventNotificationFire.objects.latest('id')
+        self.assertEqual(json.loads(next(events).decode()[len('data: '):])['fire'],
+                         fire.id)
+        response.close()
+
+        broker = push.get_broker()
+        self.assertFalse(broker._listeners)
+
+    @override_settings(PYNOT_PUSH_BROKER='pynot.push.LocalBroker',
+                       PYNOT_BULK_CHUNK_SIZE=1)
+    def test_push_batches(self):
+        broker = push.get_broker()
+        users = {'user:{0}'.format(user.id) for user in self.users[:2]}
+        for fanout in (False, True):
+            with override_settings(PYNOT_DB_FANOUT=fanout), \
+                    mock.patch.object(broker, 'publish') as publish:
+                # Fires of a single transaction publish their users once it
+                # commits, reading them back in bounded batches
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.event.fire(group=self.group)
+                    publish.assert_not_called()
+            fire = EventNotificationFire.objects.latest('id')
+            channels = [call.args[0] for call in publish.call_args_list]
+            # One user per batch, every member once and no group channels
+            self.assertEqual([len(batch) for batch in channels], [1, 1])
+            self.assertEqual(set(sum(channels, [])), users)
+            for call in publish.call_args_list:
+                self.assertEqual(call.args[1]['fire'], fire.id)
+
+    def test_push_disabled(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get(reverse('notification-stream'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_retention(self):
+        other_event = EventFactory.create(category=self.event.category)
+        EventNotificationFactory.create(event=other_event)
+        self.notification.collective = True
+        self.notification.save()
+        self.event.fire(group=self.group)
+        other_event.fire()
+        EventNotificationFire.objects.update(
+            creation_datetime=timezone.now() - datetime.timedelta(days=10))
+
+        # The policy of the event rules over the one of its category
+        RetentionPolicy.objects.create(category=self.event.category, days=5)
+        policy = RetentionPolicy.objects.create(event=self.event, days=30)
+        self.assertEqual(policy.purge(1), (0, 0))
+        policy.days = 5
+        policy.archive = True
+        policy.save()
+
+        fire = self.notification.fires.get()
+        notification = Notification.objects.get(notification=fire)
+        with mock.patch('builtins.print'):
+            tasks.purge_notifications()
+        self.assertFalse(EventNotificationFire.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(Notification.users.through.objects.exists())
+
+        archived = ArchivedEventNotificationFire.objects.get()
+        self.assertEqual((archived.id, archived.event_id, archived.subject),
+                         (fire.id, self.event.id, 'Hello group'))
+        archived = ArchivedNotification.objects.get()
+        self.assertEqual((archived.id, archived.fire_id), (notification.id, fire.id))
+        self.assertEqual(sorted(json.loads(archived.users)),
+                         [self.users[0].id, self.users[1].id])
+
+    def test_purge_counters(self):
+        self.event.fire(group=self.group)
+        Notification.objects.filter(owner=self.users[1]).update(is_read=True)
+        self.notification.collective = True
+        self.notification.save()
+        with override_settings(PYNOT_COLLECTIVE_GROUPS=True):
+            self.event.fire(group=self.group)
+        collective = Notification.objects.get(collective=True)
+        collective.set_state(self.users[0], is_read=True)
+        self.event.fire(group=self.group)
+
+        counters = [NotificationCounter.for_user(user) for user in self.users]
+        self.assertEqual([counter.unread for counter in counters], [2, 2, 0])
+
+        EventNotificationFire.objects.update(
+            creation_datetime=timezone.now() - datetime.timedelta(days=10))
+        RetentionPolicy.objects.create(days=5)
+        with mock.patch('builtins.print'):
+            tasks.purge_notifications()
+        self.assertFalse(Notification.objects.exists())
+        for counter in counters:
+            version = counter.version
+            counter.refresh_from_db()
+            self.assertEqual(counter.unread, 0)
+            if counter.user_id != self.users[2].id:
+                self.assertGreater(counter.version, version)
+        self.assertEqual(counters[2].version, 0)
+
+    @override_settings(PYNOT_ERASED_RETENTION_DAYS=1)
+    def test_purge_erased(self):
+        self.event.fire(group=self.group)
+        erased = Notification.objects.first()
+        erased.delete()
+        Notification.all_objects.filter(pk=erased.pk).update(
+            last_update_datetime=timezone.now() - datetime.timedelta(days=2))
+
+        with mock.patch('builtins.print'):
+            tasks.purge_notifications()
+        self.assertFalse(Notification.all_objects.filter(pk=erased.pk).exists())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_partitions_postgresql_only(self):
+        with self.assertRaises(CommandError):
+            call_command('pynot_partitions')
+
+    @override_settings(PYNOT_BODY_STORE=True, PYNOT_BODY_COMPRESS=True)
+    def test_body_store(self):
+        self.notification.message = 'Message for group.name ' + 'x' * 1000
+        self.notification.save()
+        for i in range(3):
+            self.event.fire(group=self.group)
+
+        self.assertEqual(NotificationBody.objects.count(), 2)
+        self.assertEqual(set(EventNotificationFire.objects
+                             .values_list('subject', 'message')), {('', '')})
+        body = NotificationBody.objects.get(compressed=True)
+        self.assertLess(len(bytes(body.content)), 1000)
+        self.assertEqual(NotificationBody.objects.get(pk=body.pk).text,
+                         'Message for group ' + 'x' * 1000)
+
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        NotificationCounter.for_user(self.users[0])
+        for page_size in (1, 3):
+            # Inbox version, page of each branch, subjects and messages
+            with self.assertNumQueries(5):
+                response = client.get(reverse('notification-list'),
+                                      {'page_size': page_size})
+        fire = response.data['results'][0]['notification']
+        self.assertEqual(fire['subject'], 'Hello group')
+        self.assertEqual(fire['message'], body.text)
+
+        # The stored bodies cannot be searched
+        response = client.get(reverse('notification-list'), {'search': 'Hello'})
+        self.assertEqual(response.status_code, 400)
+
+        EventNotificationFire.objects.update(
+            creation_datetime=timezone.now() - datetime.timedelta(days=10))
+        RetentionPolicy.objects.create(days=5)
+        with mock.patch('builtins.print'):
+            tasks.purge_notifications()
+        # Orphans, but too recent to be purged
+        self.assertEqual(NotificationBody.objects.count(), 2)
+
+        NotificationBody.objects.update(
+            last_use_datetime=timezone.now() - datetime.timedelta(days=2))
+        # A reused body leaves the orphans
+        NotificationBody.store(['Hello group'])
+        self.assertEqual(NotificationBody.orphans().get(), body)
+        with mock.patch('builtins.print'):
+            tasks.purge_notifications()
+        self.assertEqual(NotificationBody.objects.get().text, 'Hello group')
+
+    def test_resolve_users(self):
+        other_group = Group.objects.create(name='other')
+        other_group.user_set.add(self.users[1], self.users[2])
+        direct = [str(self.users[2].id), str(self.users[2].id)]
+
+        with self.assertNumQueries(1):
+            users = list(EventNotification.resolve_users(
+                direct, [self.group.id, other_group.id], 1))
+        self.assertEqual(users, [self.users[0].id, self.users[1].id,
+                                 self.users[2].id])
+
+    @override_settings(PYNOT_BULK_CHUNK_SIZE=1, PYNOT_FIRE_ATOMIC='chunk')
+    def test_resume_fire(self):
+        bulk_create_users = Notification.bulk_create_users
+        calls = []
+
+        def interrupted(fire, users):
+            calls.append(users)
+            if len(calls) > 1:
+                raise Exception("Worker lost")
+            bulk_create_users(fire, users)
+
+        with mock.patch.object(Notification, 'bulk_create_users', interrupted):
+            with self.assertRaises(Exception):
+                self.event.fire(group=self.group)
+
+        fire = EventNotificationFire.objects.get()
+        self.assertEqual(fire.status, 'in_process')
+        self.assertEqual(fire.cursor, str(self.users[0].id))
+        self.assertEqual(Notification.objects.count(), 1)
+
+        fire.deliver(resume=True)
+        fire.refresh_from_db()
+        self.assertEqual(fire.status, 'complete')
+        self.assertEqual(set(Notification.objects.values_list('owner_id', flat=True)),
+                         {self.users[0].id, self.users[1].id})
+
+    def test_registry(self):
+        event = PyNot.event('group_event')
+        with self.assertNumQueries(0):
+            self.assertIs(PyNot.event('group_event'), event)
+            event.referenced_paths(event.hydrated_notifications())
+
+        self.notification.save()
+        self.assertIsNot(PyNot.event('group_event'), event)
+
+    @override_settings(PYNOT_REGISTRY_CACHE='default')
+    def test_registry_version(self):
+        from django.core.cache import cache
+
+        event = PyNot.event('group_event')
+        self.assertIs(PyNot.event('group_event'), event)
+        # Other process changes the configuration
+        cache.set('pynot:registry:version', 'changed', None)
+        self.assertIsNot(PyNot.event('group_event'), event)
+
+    def test_fire_stale_registry(self):
+        event = PyNot.event('group_event')
+        # Other process adds a notification, so this registry is not emptied
+        with mock.patch.object(PyNot, 'invalidate'):
+            notification = EventNotificationFactory.create(
+                event=self.event, subject='New', message='New')
+            EventNotificationRecipientFactory.create(
+                notification=notification, recipient='group.id', type='group')
+        self.assertIs(PyNot.event('group_event'), event)
+
+        expanded = {'group.id': str(self.group.id)}
+        with mock.patch.object(tasks.fire_recipients, 'delay'):
+            tasks.fire_event_notification('group_event', notification.id,
+                                          expanded)
+        self.assertEqual(notification.fires.get().subject, 'New')
+        self.assertIsNot(PyNot.event('group_event'), event)
+
+        with self.assertRaises(EventNotification.DoesNotExist):
+            tasks.fire_event_notification('group_event', 0, expanded)
+
+    @override_settings(PYNOT_EMAIL_BATCH_SIZE=2)
+    def test_send_email_batch(self):
+        for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+            EventNotificationRecipientFactory.create(
+                notification=self.notification, recipient=email, type='email')
+
+        with mock.patch.object(tasks.send_email_batch, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.event.fire(group=self.group)
+        self.assertEqual([len(args[0]) for args, kwargs in delay.call_args_list],
+                         [2, 1])
+
+        for args, kwargs in delay.call_args_list:
+            tasks.send_email_batch(*args)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].subject, 'Hello group')
+        self.assertFalse(Notification.objects.filter(type='email')
+                         .exclude(status='complete').exists())
+
+    def test_send_email_batch_connection_error(self):
+        for email in ('a@example.com', 'b@example.com'):
+            EventNotificationRecipientFactory.create(
+                notification=self.notification, recipient=email, type='email')
+        with mock.patch.object(tasks.send_email_batch, 'delay'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.event.fire(group=self.group)
+        not_ids = list(Notification.objects.filter(type='email')
+                       .values_list('id', flat=True))
+
+        error = OSError('Connection refused')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open',
+                        side_effect=error), \
+                mock.patch.object(tasks.send_email_batch, 'retry',
+                                  side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                tasks.send_email_batch(not_ids)
+        self.assertEqual(sorted(retry.call_args[1]['args'][0]), sorted(not_ids))
+        self.assertEqual(retry.call_args[1]['countdown'], 10)
+        self.assertEqual(retry.call_args[1]['max_retries'], 120)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(Notification.objects.filter(type='email')
+                         .exclude(status='pending').exists())
+
+
+SMTP_CONFIG = {'pynot': {'host': 'localhost', 'port': 25, 'username': '',
+                         'password': '', 'pool': True}}
+
+
+@override_settings(SMTP_CONFIG=SMTP_CONFIG)
+class SMTPConnectionPoolTestCase(TestCase):
+
+    def tearDown(self):
+        util_email.discard_pooled_connection('pynot')
+
+    def test_connection_reused(self):
+        connection = util_email.get_connection('pynot')
+        self.assertTrue(connection.pooled)
+        self.assertIs(util_email.get_connection('pynot'), connection)
+
+        util_email.send_email('a@example.com', 'Subject', '{{ message }}',
+                              context={'message': 'Hi'},
+                              smtp_config_name='pynot')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIs(util_email.get_connection('pynot'), connection)
+
+    def test_failed_connection_discarded(self):
+        connection = util_email.get_connection('pynot')
+        with mock.patch.object(util_email, 'is_alive', return_value=False), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.open',
+                           side_effect=OSError):
+            with self.assertRaises(OSError):
+                util_email.send_emails([{'to_email': 'a@example.com',
+                                         'subject': 'Subject',
+                                         'template': '{{ message }}'}],
+                                       smtp_config_name='pynot')
+        self.assertNotIn('pynot', util_email._pool.connections)
+        self.assertIsNot(util_email.get_connection('pynot'), connection)
+
+    def test_idle_connection_evicted(self):
+        with self.settings(SMTP_CONFIG={'pynot': dict(SMTP_CONFIG['pynot'],
+                                                      pool_ttl=-1)}):
+            connection = util_email.get_connection('pynot')
+            self.assertIsNot(util_email.get_connection('pynot'), connection)
+
+
+class ConfigTestCase(TestCase):
+
+    def test_load_cached(self):
+        Config.load()
+        with self.assertNumQueries(0):
+            config = Config.load()
+
+        config.email_template = '<p>{{ message }}</p>'
+        config.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(Config.load().email_template,
+                             '<p>{{ message }}</p>')
+
+    def test_load_expired(self):
+        Config._loaded = None
+        Config.load()
+        Config.objects.update(email_template='<p>{{ message }}</p>')
+        with mock.patch.object(Config, 'load_ttl', -1):
+            self.assertEqual(Config.load().email_template,
+                             '<p>{{ message }}</p>')
+
+    def test_render_content_compiled_once(self):
+        util_email.compile_template.cache_clear()
+        for message in ('first', 'second'):
+            content = util_email.render_content('<b>{{ message }}</b>',
+                                                {'message': message})
+        self.assertEqual(content['html_content'], '<b>second</b>')
+        self.assertEqual(content['text_content'], '<b>second</b>')
+        self.assertEqual(util_email.compile_template.cache_info().misses, 1)
+
+
+class PlaceholderTestCase(TestCase):
+    data = {'user.name': 'Ana', 'user.name_full': 'Ana Ruiz',
+            'user.emails': ('a@example.com', 'b@example.com'),
+            'site.domain': 'example.com'}
+
+    def test_longest_match(self):
+        template = PlaceholderTemplate('Hi user.name_full (user.name)')
+        self.assertEqual(template.render(self.data), 'Hi Ana Ruiz (Ana)')
+
+    def test_partial_match(self):
+        template = PlaceholderTemplate('Bye user.name.site.domain.')
+        self.assertEqual(template.render(self.data), 'Bye Ana.example.com.')
+
+    def test_unknown_and_tuples(self):
+        template = PlaceholderTemplate('www.google.com user.emails user.age')
+        self.assertEqual(template.render(self.data),
+                         'www.google.com user.emails user.age')
+
+
+class ExpandParamsTestCase(TestCase):
+    params = {'offer': {'title': 'Offer', 'price': 10,
+                        'owner': {'email': 'owner@example.com', 'name': 'Ana'},
+                        'users': [{'email': 'a@example.com', 'id': 1,
+                                   'groups': [{'id': 3}, {'id': 4}]},
+                                  {'email': 'b@example.com', 'id': 2,
+                                   'groups': [{'id': 5}]}]}}
+
+    def test_expand_all(self):
+        expanded = Event.expand_params(self.params)
+        self.assertEqual(expanded['offer.price'], '10')
+        self.assertEqual(expanded['offer.owner.name'], 'Ana')
+        self.assertEqual(expanded['offer.users.email'],
+                         ('a@example.com', 'b@example.com'))
+        self.assertEqual(expanded['offer.users.groups.id'], ('3', '4', '5'))
+
+    def test_expand_referenced_paths(self):
+        notification = EventNotificationFactory.create(
+            subject='New offer.title', message='Price: offer.price')
+        EventNotificationRecipientFactory.create(
+            notification=notification, recipient='offer.users.email',
+            type='email')
+
+        paths = notification.event.referenced_paths()
+        expanded = Event.expand_params(self.params, paths=paths)
+        self.assertEqual(expanded, {'offer.title': 'Offer', 'offer.price': '10',
+                                    'offer.users.email': ('a@example.com',
+                                                          'b@example.com')})
+
+
+PYNOT_SETTINGS = {
+    'accounts': {
+        'name': 'Accounts',
+        'events': {
+            'registration': {
+                'name': 'New registration',
+                'description': 'Fired when a user registers',
+                'parameters': {
+                    'category': {'human_name': 'Category',
+                                 'serializer': 'pynot.tests.CategoryTestSerializer'}
+                }
+            }
+        }
+    }
+}
+
+
+@override_settings(PYNOT_SETTINGS=PYNOT_SETTINGS)
+class SyncSettingsTestCase(TestCase):
+
+    def setUp(self):
+        PyNot._fingerprints = {}
+        Config._loaded = None
+
+    def test_sync_settings(self):
+        PyNot.sync_settings()
+        event = Event.objects.get(slug='registration')
+        self.assertEqual(event.category.name, 'Accounts')
+        self.assertEqual(event.parameters.get().human_name, 'Category')
+
+        with self.assertNumQueries(0):
+            PyNot.sync_settings()
+
+    def test_sync_changed_settings(self):
+        PyNot.sync_settings()
+        pynot_settings = {'accounts': dict(PYNOT_SETTINGS['accounts'],
+                                           name='Users')}
+        with self.settings(PYNOT_SETTINGS=pynot_settings):
+            PyNot.sync_settings()
+        self.assertEqual(Category.objects.get(slug='accounts').name, 'Users')
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(Parameter.objects.count(), 1)
+
+    def test_sync_after_migrate(self):
+        from django.apps import apps as django_apps
+        from pynot import apps
+        sender = django_apps.get_app_config('pynot')
+        with mock.patch.object(PyNot, 'sync_settings') as sync_settings:
+            apps.sync_settings(sender, using='default')
+            sync_settings.assert_called_once_with(using='default')
+
+            # Migrated to an older migration
+            sync_settings.reset_mock()
+            with mock.patch('pynot.apps.MigrationLoader') as loader:
+                loader.return_value.graph.leaf_nodes.return_value = [
+                    ('pynot', '9999_future')]
+                apps.sync_settings(sender, using='default')
+            sync_settings.assert_not_called()
+
+    def test_sync_keeps_config(self):
+        Config.load()
+        # Saved by another process
+        Config.objects.update(email_template='<p>{{ message }}</p>')
+        PyNot.sync_settings()
+        config = Config.objects.get()
+        self.assertEqual(config.email_template, '<p>{{ message }}</p>')
+        self.assertEqual(config.settings_fingerprint,
+                         PyNot.settings_fingerprint())
+
+    def test_sync_moved_event(self):
+        PyNot.sync_settings()
+        event = Event.objects.get(slug='registration')
+        fire = EventNotificationFire.objects.create(
+            event_notification=EventNotificationFactory.create(event=event),
+            message='')
+        notification = Notification.objects.create(
+            notification=fire, event=event, category=event.category)
+
+        with self.settings(PYNOT_SETTINGS={'users': PYNOT_SETTINGS['accounts']}):
+            PyNot.sync_settings()
+        notification.refresh_from_db()
+        self.assertEqual(notification.category.slug, 'users')
+
+
 class EventNotificationTestCase(DetailAPITestCaseMixin,
                                 WriteRESTAPITestCaseMixin,
                                 BaseRESTAPITestCase):
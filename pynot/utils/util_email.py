@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import threading
+import time
+
 from django.conf import settings
 from django.core import mail
 from django.template import loader, Context, RequestContext, Template
@@ -9,9 +13,23 @@ from django.template import loader, Context, RequestContext, Template
 ########################################################################
 
 
+@functools.lru_cache(maxsize=128)
+def compile_template(template):
+	"""Compila la plantilla recibida.
+	
+	Las plantillas compiladas se guardan en una caché LRU indexada por su
+	código fuente, de forma que cada plantilla se compila una única vez.
+	
+	"""
+	
+	return Template(template)
+
+
 def render_content(template, context={}, request=None):
 	"""Renderiza el contenido para un email a partir de la plantilla y el contexto.
-	Deben existir las versiones ".html" y ".txt" de la plantilla.
+	
+	El contenido en texto y en html se obtienen de la misma plantilla, por lo
+	que ésta se renderiza una única vez.
 	
 	Adicionalmente, si se recibe el request, se utilizará para el renderizado.
 	
@@ -22,20 +40,116 @@ def render_content(template, context={}, request=None):
 	else:
 		context_class = Context(context)
 
-	template = Template(template)
+	content = compile_template(template).render(context_class)
 
 	return {
-		"text_content": template.render(context_class),
-		"html_content": template.render(context_class)
+		"text_content": content,
+		"html_content": content
 	}
 
 
+## Conexiones SMTP reutilizables de cada hilo, por nombre de configuración
+_pool = threading.local()
+
+
+def new_connection(smtp_config):
+	"""Instancia una conexión SMTP a partir de una de las configuraciones
+	definidas en settings.
+	
+	"""
+	
+	use_tls = False
+	use_ssl = False
+	
+	if "use_tls" in smtp_config:
+		use_tls = smtp_config["use_tls"]
+	
+	if "use_ssl" in smtp_config:
+		use_ssl = smtp_config["use_ssl"]
+	
+	return mail.get_connection(
+		host=smtp_config["host"],
+		port=smtp_config["port"],
+		username=smtp_config["username"],
+		password=smtp_config["password"],
+		use_tls=use_tls, use_ssl=use_ssl, fail_silently=False)
+
+
+def is_alive(connection):
+	"""Comprueba mediante un NOOP que la conexión SMTP sigue abierta.
+	
+	Los backends que no mantienen un socket abierto siempre están disponibles.
+	
+	"""
+	
+	if not hasattr(connection, "connection"):
+		return True
+	
+	if connection.connection is None:
+		return False
+	
+	try:
+		return connection.connection.noop()[0] == 250
+	except Exception:
+		return False
+
+
+def discard_pooled_connection(smtp_config_name):
+	"""Cierra y descarta la conexión del pool del hilo actual."""
+	
+	connections = getattr(_pool, "connections", {})
+	if smtp_config_name in connections:
+		connection = connections.pop(smtp_config_name)["connection"]
+		try:
+			connection.close()
+		except Exception:
+			pass
+
+
+def get_pooled_connection(smtp_config_name):
+	"""Devuelve una conexión SMTP abierta y autenticada del pool del hilo actual.
+	
+	Las conexiones que llevan más de "pool_ttl" segundos sin utilizarse se
+	cierran, y las que no responden al NOOP se vuelven a abrir.
+	
+	"""
+	
+	if not hasattr(_pool, "connections"):
+		_pool.connections = {}
+	
+	now = time.monotonic()
+	for name in list(_pool.connections):
+		entry = _pool.connections[name]
+		if now - entry["last_use"] > entry["ttl"]:
+			discard_pooled_connection(name)
+	
+	entry = _pool.connections.get(smtp_config_name)
+	if entry and not is_alive(entry["connection"]):
+		discard_pooled_connection(smtp_config_name)
+		entry = None
+	
+	if not entry:
+		smtp_config = settings.SMTP_CONFIG[smtp_config_name]
+		connection = new_connection(smtp_config)
+		connection.open()
+		# Al estar abierta, los envíos no cierran la conexión tras cada mensaje
+		connection.pooled = True
+		entry = {"connection": connection, "ttl": smtp_config.get("pool_ttl", 60)}
+		_pool.connections[smtp_config_name] = entry
+	
+	entry["last_use"] = now
+	return entry["connection"]
+
+
 def get_connection(smtp_config_name):
 	"""Devuelve la conexión SMTP a utilizar, en caso de que sea necesario.
 	
 	Será necesario instanciar una conexión SMTP si se recibe el nombre de una
 	configuración SMTP a utilizar de las definidas en settings (y ésta existe).
 	
+	Si la configuración incluye "pool", la conexión se mantiene abierta y se
+	reutiliza en los siguientes envíos del mismo hilo.
+	
 	"""
 	
 	connection = None
@@ -48,21 +162,10 @@ def get_connection(smtp_config_name):
 	
 	if smtp_config and smtp_config_name and smtp_config_name in settings.SMTP_CONFIG:
 		
-		use_tls = False
-		use_ssl = False
-		
-		if "use_tls" in settings.SMTP_CONFIG[smtp_config_name]:
-			use_tls = settings.SMTP_CONFIG[smtp_config_name]["use_tls"]
-		
-		if "use_ssl" in settings.SMTP_CONFIG[smtp_config_name]:
-			use_ssl = settings.SMTP_CONFIG[smtp_config_name]["use_ssl"]
-			
-		connection = mail.get_connection(
-			host=settings.SMTP_CONFIG[smtp_config_name]["host"],
-			port=settings.SMTP_CONFIG[smtp_config_name]["port"],
-			username=settings.SMTP_CONFIG[smtp_config_name]["username"],
-			password=settings.SMTP_CONFIG[smtp_config_name]["password"],
-			use_tls=use_tls, use_ssl=use_ssl, fail_silently=False)
+		if settings.SMTP_CONFIG[smtp_config_name].get("pool"):
+			connection = get_pooled_connection(smtp_config_name)
+		else:
+			connection = new_connection(settings.SMTP_CONFIG[smtp_config_name])
 	
 	return connection
 
@@ -93,13 +196,14 @@ def get_from_email(from_email_received, smtp_config_name):
 	return from_email
 
 
-def get_email(to_email, subject, template, from_email=None, context={}, request=None, smtp_config_name=None, cc=None, bcc=None):
+def get_email(to_email, subject, template, from_email=None, context={}, request=None, smtp_config_name=None, cc=None, bcc=None, connection=None):
 	"""Instancia un objeto de EmailMultiAlternative a partir de los datos recibidos."""
 	
 	if not isinstance(to_email, list) and not isinstance(to_email, dict):
 		to_email = [to_email]
 	
-	connection = get_connection(smtp_config_name)
+	if not connection:
+		connection = get_connection(smtp_config_name)
 	from_email_resolved = get_from_email(from_email, smtp_config_name)
 	
 	content = render_content(template, context, request)
@@ -142,11 +246,44 @@ def send_email_from_content(to_email, subject, html_content, text_content, from_
 	msg.send()
 
 
-def send_emails(emails_config):
-	"""Envío de varios emails haciendo uso de una única conexión."""
+def send_emails(emails_config, smtp_config_name=None):
+	"""Envío de varios emails haciendo uso de una única conexión.
+	
+	Devuelve una lista con el resultado del envío de cada email: None si se ha
+	enviado correctamente o la excepción producida en caso contrario.
+	
+	Si no se puede abrir la conexión (conexión o autenticación SMTP) no se envía
+	ninguno de los emails: se descarta la conexión del pool y se lanza la
+	excepción, para que se reintente el bloque completo.
+	
+	"""
+	
+	results = []
 	
 	if emails_config:
 		
-		connection = mail.get_connection()
-		emails = [get_email(**email_config) for email_config in emails_config]
-		connection.send_messages(emails)
+		try:
+			connection = get_connection(smtp_config_name) or mail.get_connection()
+			pooled = getattr(connection, "pooled", False)
+			# Al estar abierta la conexión, send_messages no la cierra tras cada envío
+			if not pooled:
+				connection.open()
+		except Exception:
+			if smtp_config_name:
+				discard_pooled_connection(smtp_config_name)
+			raise
+		
+		emails = [get_email(connection=connection, **email_config) for email_config in emails_config]
+		
+		try:
+			for email in emails:
+				try:
+					connection.send_messages([email])
+					results.append(None)
+				except Exception as e:
+					results.append(e)
+		finally:
+			if not pooled:
+				connection.close()
+	
+	return results
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import re
+
+from django.db import connection, transaction
+
+
+########################################################################
+########################################################################
+
+## Nombre de las particiones mensuales: <tabla>_pAAAAMM
+PARTITION_RE = r"^{0}_p(\d{{4}})(\d{{2}})$"
+
+
+def month_start(date, months=0):
+	"""Devuelve el primer día del mes de date, desplazado months meses."""
+
+	month = date.year * 12 + date.month - 1 + months
+	return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def is_partitioned(table):
+	"""Informa de si la tabla de PostgreSQL está particionada."""
+
+	with connection.cursor() as cursor:
+		cursor.execute(
+			"SELECT 1 FROM pg_partitioned_table p "
+			"JOIN pg_class c ON c.oid = p.partrelid "
+			"WHERE c.relname = %s", [table])
+		return cursor.fetchone() is not None
+
+
+def partition_table(table, column):
+	"""Convierte la tabla de PostgreSQL en una tabla particionada por rangos de
+	la columna, con una partición por defecto a la que se copian las filas
+	existentes.
+
+	La clave primaria pasa a ser (id, columna), ya que debe incluir la
+	columna de particionado. La tabla se bloquea mientras se copia, por lo
+	que conviene hacerlo con la tabla vacía o en una ventana de mantenimiento.
+
+	"""
+
+	quote = connection.ops.quote_name
+	names = {
+		"table": quote(table),
+		"new": quote(table + "_partitioned"),
+		"pkey": quote(table + "_part_pkey"),
+		"default": quote(table + "_default"),
+		"column": quote(column),
+	}
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(
+			"CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) "
+			"PARTITION BY RANGE ({column})".format(**names))
+		cursor.execute(
+			"ALTER TABLE {new} ADD CONSTRAINT {pkey} "
+			"PRIMARY KEY (id, {column})".format(**names))
+		cursor.execute(
+			"CREATE TABLE {default} PARTITION OF {new} DEFAULT".format(**names))
+		cursor.execute("INSERT INTO {new} SELECT * FROM {table}".format(**names))
+		cursor.execute("DROP TABLE {table}".format(**names))
+		cursor.execute("ALTER TABLE {new} RENAME TO {table}".format(**names))
+
+
+def create_partitions(table, column, start, months):
+	"""Crea las particiones mensuales de la tabla desde el mes de start, si no
+	existen.
+
+	Deben crearse antes de que lleguen sus filas, ya que no puede crearse la
+	partición de un mes con filas en la partición por defecto: esos meses se
+	dejan en la partición por defecto.
+
+	"""
+
+	quote = connection.ops.quote_name
+	created = []
+	with connection.cursor() as cursor:
+		for month in range(months):
+			first = month_start(start, month)
+			name = "{0}_p{1:%Y%m}".format(table, first)
+			cursor.execute(
+				"SELECT 1 FROM {0} WHERE {1} >= %s AND {1} < %s LIMIT 1".format(
+					quote(table + "_default"), quote(column)),
+				[first, month_start(first, 1)])
+			if cursor.fetchone():
+				continue
+			cursor.execute(
+				"CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} "
+				"FOR VALUES FROM (%s) TO (%s)".format(quote(name), quote(table)),
+				[first, month_start(first, 1)])
+			created.append(name)
+	return created
+
+
+def drop_partitions_before(table, date):
+	"""Elimina las particiones mensuales de la tabla anteriores al mes de date.
+
+	Eliminar una partición no recorre sus filas, por lo que la purga de los
+	meses antiguos es inmediata.
+
+	"""
+
+	quote = connection.ops.quote_name
+	limit = month_start(date)
+	dropped = []
+	with connection.cursor() as cursor:
+		cursor.execute(
+			"SELECT c.relname FROM pg_inherits i "
+			"JOIN pg_class c ON c.oid = i.inhrelid "
+			"JOIN pg_class p ON p.oid = i.inhparent "
+			"WHERE p.relname = %s", [table])
+		for name, in cursor.fetchall():
+			match = re.match(PARTITION_RE.format(re.escape(table)), name)
+			if match and datetime.date(int(match.group(1)),
+									   int(match.group(2)), 1) < limit:
+				cursor.execute("DROP TABLE {0}".format(quote(name)))
+				dropped.append(name)
+	return dropped
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import re
+
+
+########################################################################
+########################################################################
+
+## Posibles marcadores: identificadores separados por puntos, como "user.name"
+PLACEHOLDER_RE = re.compile(r"(\w+(?:\.\w+)+)")
+
+
+class PlaceholderTemplate(object):
+	"""Texto con marcadores de parámetros expandidos, dividido en fragmentos.
+
+	El texto se divide una única vez en fragmentos literales y posibles
+	marcadores, de forma que la sustitución se resuelve en una sola pasada.
+
+	"""
+
+	def __init__(self, text):
+		## Fragmentos del texto: en las posiciones pares los literales y en
+		## las impares los posibles marcadores
+		self.parts = PLACEHOLDER_RE.split(text)
+		## Segmentos de cada posible marcador
+		self.placeholders = [tuple(part.split(".")) for part in self.parts[1::2]]
+
+	def keys(self):
+		"""Devuelve las claves que pueden sustituirse en el texto.
+
+		Por la coincidencia parcial de marcadores, cualquier secuencia de
+		segmentos consecutivos de un marcador puede ser una clave.
+
+		"""
+
+		keys = set()
+		for segments in self.placeholders:
+			for start in range(len(segments)):
+				for end in range(start + 1, len(segments) + 1):
+					keys.add(".".join(segments[start:end]))
+		return keys
+
+	def render(self, data):
+		"""Sustituye los marcadores por su valor en data.
+
+		Sólo se sustituyen los valores simples, no las tuplas.
+
+		"""
+
+		if not self.placeholders:
+			return self.parts[0]
+
+		parts = list(self.parts)
+		for index, segments in enumerate(self.placeholders):
+			parts[2 * index + 1] = render_placeholder(segments, data)
+		return "".join(parts)
+
+
+def render_placeholder(segments, data):
+	"""Sustituye un posible marcador, con el criterio de coincidencia más larga.
+
+	Así "user.name_full" nunca se sustituye con el valor de "user.name". Si sólo
+	coincide el comienzo del marcador, se continúa con el resto de segmentos.
+
+	"""
+
+	value = data.get(".".join(segments))
+	if value is not None and not isinstance(value, tuple):
+		return value
+
+	result = []
+	start = 0
+	while start < len(segments):
+		for end in range(len(segments), start, -1):
+			value = data.get(".".join(segments[start:end]))
+			if value is not None and not isinstance(value, tuple):
+				result.append(value)
+				start = end
+				break
+		else:
+			result.append(segments[start])
+			start += 1
+	return ".".join(result)
+
+
+def with_prefixes(keys):
+	"""Devuelve las claves recibidas junto con todos sus prefijos.
+
+	Por ejemplo, "user.address.city" da lugar a "user", "user.address" y
+	"user.address.city".
+
+	"""
+
+	paths = set()
+	for key in keys:
+		segments = key.split(".")
+		for end in range(1, len(segments) + 1):
+			paths.add(".".join(segments[:end]))
+	return paths
+
+
+@functools.lru_cache(maxsize=256)
+def compile_text(text):
+	"""Devuelve el PlaceholderTemplate del texto, compilado una única vez."""
+
+	return PlaceholderTemplate(text)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+
+
+########################################################################
+########################################################################
+
+## Valores por defecto de las opciones de configuración de Pynot
+DEFAULTS = {
+	## Número de filas escritas en cada sentencia INSERT durante la difusión
+	"PYNOT_BULK_CHUNK_SIZE": 1000,
+	## Frontera transaccional de la difusión: "fire", "chunk" o None
+	"PYNOT_FIRE_ATOMIC": "fire",
+	## Guardar los grupos destinatarios de las notificaciones colectivas, en
+	## lugar de un propietario por cada uno de sus miembros
+	"PYNOT_COLLECTIVE_GROUPS": False,
+	## Notificar a los miembros de los grupos con INSERT ... SELECT
+	"PYNOT_DB_FANOUT": False,
+	## Segundos sin progreso tras los que se reanuda una difusión interrumpida
+	"PYNOT_FIRE_RESUME_AFTER": 600,
+	## Número de emails enviados por cada tarea send_email_batch
+	"PYNOT_EMAIL_BATCH_SIZE": 100,
+	## Caché en la que se comparte la versión del registro de eventos
+	"PYNOT_REGISTRY_CACHE": None,
+	## Caché en la que se comparten los esquemas de los serializadores
+	"PYNOT_SCHEMA_CACHE": None,
+	## Número de notificaciones por página del buzón
+	"PYNOT_PAGE_SIZE": 20,
+	## Caché en la que se guardan las primeras páginas del buzón
+	"PYNOT_INBOX_CACHE": None,
+	## Clase del broker al que se publican las notificaciones para su envío
+	## inmediato
+	"PYNOT_PUSH_BROKER": None,
+	## Segundos entre los latidos del canal de eventos del buzón
+	"PYNOT_PUSH_HEARTBEAT": 15,
+	## Número de filas borradas o archivadas en cada transacción de la purga
+	"PYNOT_PURGE_CHUNK_SIZE": 500,
+	## Días tras los que se eliminan las notificaciones borradas lógicamente
+	"PYNOT_ERASED_RETENTION_DAYS": None,
+	## Guardar los asuntos y mensajes una única vez, indexados por su hash
+	"PYNOT_BODY_STORE": False,
+	## Comprimir con zlib los asuntos y mensajes guardados
+	"PYNOT_BODY_COMPRESS": False,
+}
+
+
+def get_setting(name):
+	"""Devuelve el valor de una opción de configuración de Pynot.
+	
+	Si la opción no está definida en settings se utiliza su valor por defecto.
+	
+	"""
+	
+	return getattr(settings, name, DEFAULTS[name])
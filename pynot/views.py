@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
 """
 """
+import hashlib
+import json
+from calendar import timegm
+
+from django.core.cache import caches
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django_filters import rest_framework as filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import BaseFilterBackend, SearchFilter
 from rest_framework.permissions import IsAuthenticated
@@ -8,10 +18,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.mixins import RetrieveModelMixin, UpdateModelMixin, ListModelMixin, CreateModelMixin, DestroyModelMixin
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
 
 from . import models
+from . import push
 from . import serializers
+from .pagination import NotificationCursorPagination
+from .utils.util_settings import get_setting
 
 
 class CategoryView(RetrieveModelMixin, ListModelMixin, GenericViewSet):
@@ -27,10 +42,17 @@ class CategoryView(RetrieveModelMixin, ListModelMixin, GenericViewSet):
     queryset = models.Category.objects.all()
     serializer_class = serializers.CategorySerializer
 
-    def list(self, request, *args, **kwargs):
-        models.PyNot.sync_settings()
-
-        return super(CategoryView, self).list(request, args, kwargs)
+    def get_queryset(self):
+        """
+        The list only shows the categories, the detail their events too
+        :return:
+        """
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(Prefetch(
+                'events', queryset=models.Event.objects.only(
+                    'id', 'name', 'description', 'category')))
+        return queryset
 
 
 
@@ -41,7 +63,10 @@ class EventView(RetrieveModelMixin, GenericViewSet):
     retrieve:
     Returns a notification event. Each event has the list of parameters
     """
-    queryset = models.Event.objects.all()
+    queryset = models.Event.objects.prefetch_related(
+        'parameters',
+        Prefetch('notifications', queryset=models.EventNotification.objects
+                 .only('id', 'name', 'description', 'type', 'event')))
     serializer_class = serializers.EventSerializer
 
 
@@ -130,45 +155,252 @@ class NotificationOwnerFilter(BaseFilterBackend):
         """
         user = request.user
         if user and user.is_authenticated:
-            return queryset.filter(users__id=user.id)
+            return models.Notification.owned_by(queryset, user)
         return queryset.model.objects.none()
 
+
+class NotificationSearchFilter(SearchFilter):
+    """
+    Search in the subject and the message of the notifications. The bodies
+    stored by PYNOT_BODY_STORE are not searchable, so the search is rejected
+    when it is enabled instead of returning nothing
+    """
+    def filter_queryset(self, request, queryset, view):
+        if get_setting("PYNOT_BODY_STORE") and self.get_search_terms(request):
+            raise ValidationError({self.search_param: "Search is not available "
+                                   "when PYNOT_BODY_STORE is enabled"})
+        return super().filter_queryset(request, queryset, view)
+
+
+class NotificationFilter(filters.FilterSet):
+    """
+    Notification filters. The reading status and the importance are those of
+    the requesting user
+    """
+    is_read = filters.BooleanFilter(field_name='user_is_read')
+    is_important = filters.BooleanFilter(field_name='user_is_important')
+    event = filters.NumberFilter(field_name='event_id')
+    category = filters.NumberFilter(field_name='category_id')
+    ## Former names of the event and category filters, kept as aliases
+    notification__event_notification__event_id = \
+        filters.NumberFilter(field_name='event_id')
+    notification__event_notification__event__category_id = \
+        filters.NumberFilter(field_name='category_id')
+
+    class Meta:
+        model = models.Notification
+        fields = ('is_read', 'is_important', 'event', 'category',
+                  'notification__event_notification__event_id',
+                  'notification__event_notification__event__category_id')
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Server-sent events. The stream is written by the view, so only errors are
+    rendered, as an error event
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return "event: error\ndata: {0}\n\n".format(json.dumps(data))
+
+
 class NotificationView(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     """
     Notification services
 
     list:
-    Returns the list of any notification
+    Returns the notifications, from the newest ones, a page at a time. The
+    next page is in the next link; the total is only returned with ?count=true.
+    It answers 304 to conditional requests (If-None-Match, If-Modified-Since)
+    when the inbox of the user has not changed
+
+    mark_read:
+    Marks the notifications as read
+    ```JSON
+    {"ids": [1, 2, 3]}
+    ```
+
+    mark_all_read:
+    Marks every notification as read. It accepts the filters of the list
+
+    mark_important:
+    Marks the notifications as important, or as not important
+    ```JSON
+    {"ids": [1, 2, 3], "is_important": true}
+    ```
+
+    stream:
+    Server-sent events with the new notifications of the user, when push
+    delivery is enabled
+    ```
+    data: {"fire": 1, "event": 1, "subject": "string"}
+    ```
     """
-    queryset = models.Notification.objects.all()
+    queryset = models.Notification.objects.select_related('notification')\
+        .defer('notification__recipients')\
+        .prefetch_related('notification__subject_body',
+                          'notification__message_body')
     serializer_class = serializers.NotificationSerializer
-    filter_backends = [NotificationOwnerFilter, DjangoFilterBackend, SearchFilter]
+    filter_backends = [NotificationOwnerFilter, DjangoFilterBackend,
+                       NotificationSearchFilter]
     permission_classes = [IsAuthenticated]
-    filter_fields = {
-        'is_read':['exact'],
-        'is_important':['exact'],
-        'notification__event_notification__event_id':['exact'],
-        'notification__event_notification__event__category_id':['exact'],
-    }
+    filterset_class = NotificationFilter
+    pagination_class = NotificationCursorPagination
 
     search_fields = ('notification__subject', 'notification__message')
 
+    def get_queryset(self):
+        """
+        Notifications with the reading status and the importance of the
+        requesting user
+        :return:
+        """
+        queryset = super().get_queryset()
+        if self.request.user and self.request.user.is_authenticated:
+            return models.Notification.with_user_state(queryset,
+                                                       self.request.user)
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        """
+        The individual and the shared notifications of the user are paginated
+        as separate branches, so each one is read in order from its index
+        :param queryset:
+        :return:
+        """
+        return super().paginate_queryset(
+            models.Notification.inbox_branches(queryset, self.request.user))
+
+    def list(self, request, *args, **kwargs):
+        counter = models.NotificationCounter.for_user(request.user)
+        etag = quote_etag("{0}-{1}".format(request.user.id, counter.version))
+        last_modified = timegm(counter.last_update_datetime.utctimetuple())
+        headers = {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+
+        response = get_conditional_response(request._request, etag=etag,
+                                            last_modified=last_modified)
+        if response is not None:
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        # First pages are cached by inbox version, so they expire when the
+        # inbox changes
+        cache_alias = get_setting("PYNOT_INBOX_CACHE")
+        key = None
+        if cache_alias and self.paginator.cursor_query_param not in \
+                request.query_params:
+            key = "pynot:inbox:{0}:{1}:{2}".format(
+                request.user.id, counter.version,
+                hashlib.sha1(request.get_full_path().encode('utf-8'))
+                .hexdigest())
+            data = caches[cache_alias].get(key)
+            if data is not None:
+                return Response(data, headers=headers)
+
+        response = super().list(request, *args, **kwargs)
+        if key:
+            caches[cache_alias].set(key, response.data)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.is_read=True
-        instance.save()
-        return super().retrieve(request, *args, **kwargs)
+        if not instance.user_is_read:
+            instance.set_state(request.user, is_read=True)
+            instance.user_is_read = True
+            models.NotificationCounter.add([request.user.id], -1)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def read_pending(self, request, *args, **kwargs):
-        self.queryset = self.queryset.filter(is_read=False, users__id=request.user.id)
-        return Response({"unread": self.queryset.count()})
+        return Response(
+            {"unread": models.NotificationCounter.unread_for(request.user)})
 
     @action(detail=True, methods=['patch'])
     def important(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.is_important = not instance.is_important
-        instance.save()
+        instance.user_is_important = not instance.user_is_important
+        instance.set_state(request.user,
+                           is_important=instance.user_is_important)
+        models.NotificationCounter.add([request.user.id], 0)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+
+    def set_state(self, request, field, value, ids=None):
+        """
+        Sets the state of the notifications of the requesting user in bulk
+        :param request:
+        :param field: is_read or is_important
+        :param value:
+        :param ids: notifications to change, every notification if None
+        :return: number of notifications changed
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        count = models.Notification.bulk_set_state(queryset, request.user,
+                                                   field, value)
+        if count:
+            models.NotificationCounter.add(
+                [request.user.id], -count if field == 'is_read' else 0)
+        return count
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request, *args, **kwargs):
+        serializer = serializers.NotificationStateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        count = self.set_state(request, 'is_read', True,
+                               serializer.validated_data['ids'])
+        return Response({"count": count})
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request, *args, **kwargs):
+        return Response({"count": self.set_state(request, 'is_read', True)})
+
+    @action(detail=False, methods=['post'])
+    def mark_important(self, request, *args, **kwargs):
+        serializer = serializers.NotificationStateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        count = self.set_state(request, 'is_important',
+                               serializer.validated_data['is_important'],
+                               serializer.validated_data['ids'])
+        return Response({"count": count})
+
+    @action(detail=False, methods=['get'],
+            renderer_classes=[EventStreamRenderer])
+    def stream(self, request, *args, **kwargs):
+        broker = push.get_broker()
+        if broker is None:
+            raise NotFound("Push delivery is disabled")
+        messages = broker.listen(push.user_channels(request.user),
+                                 get_setting("PYNOT_PUSH_HEARTBEAT"))
+        response = StreamingHttpResponse(self.event_stream(messages),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def event_stream(messages):
+        """
+        Writes the messages of the broker as server-sent events, with a
+        comment as heartbeat when there are no messages
+        :param messages: generator returned by Broker.listen
+        :return:
+        """
+        try:
+            yield ": connected\n\n"
+            for payload in messages:
+                if payload is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield "data: {0}\n\n".format(json.dumps(payload))
+        finally:
+            messages.close()
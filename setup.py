@@ -12,7 +12,8 @@ with io.open(os.path.join(here, 'README.md'), encoding='utf-8') as f:
 setup(
     name='pynot',
     version='1.1.1',
-    packages=['pynot', 'pynot.utils', 'pynot.migrations'],
+    packages=['pynot', 'pynot.utils', 'pynot.migrations', 'pynot.management',
+              'pynot.management.commands'],
     install_requires=[
         'django',
         'djangorestframework',